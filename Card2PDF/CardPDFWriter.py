@@ -1,8 +1,30 @@
-from PyQt5.QtCore import QFile, QIODevice, QSizeF, QMarginsF, QPointF, QRectF
-from PyQt5.QtGui import QPainter, QPdfWriter, QPen
+import hashlib, os, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QFile, QIODevice, QSizeF, QMarginsF, QLineF, QPointF, QRectF
+from PyQt5.QtGui import QPainter, QPdfWriter, QPen, QImage, QImageReader, QPixmap
 
 from enum import Enum
 
+from instrument import Recorder
+from layout import PackedLayout, get_layout
+
+# Image encodings a profile can ask for, Auto keeps JPEG sources lossy and everything else lossless
+IMAGE_ENCODINGS = ("Auto", "JPEG", "Flate")
+# What the "print" profile of the default settings uses
+DEFAULT_PROFILE = {"DPI": 300, "Image Encoding": "Auto", "Quality": 92, "Compression": 6}
+
+class Resample(Enum):
+    NONE = None
+    FAST = Qt.FastTransformation
+    SMOOTH = Qt.SmoothTransformation
+
+class ExportCancelled(Exception):
+    """Raised by the writer once cancel() was called, abort() then discards the PDF."""
+
 def assert_file_open(func):
     def wrapper(obj, *args, **kwargs):
         if not obj.isOpen():
@@ -10,18 +32,341 @@ def assert_file_open(func):
         return func(obj, *args, **kwargs)
     return wrapper
 
-class CardPDFWriter:
+def image_digest(card):
+    img = card.toImage() if hasattr(card, "toImage") else card
+    bits = img.constBits()
+    bits.setsize(img.sizeInBytes())
+    h = hashlib.sha1(f"{img.width()}x{img.height()}:{img.format()}".encode())
+    h.update(bits.asstring())
+    return h.hexdigest()
+
+class CardSheetWriter:
+    """Card layout shared by every PDF engine, subclasses only know how to draw."""
     RESOLUTION = 300 # 300dpi
+    # Released card images still kept, a later card with the same content reuses the image already embedded
+    RECENT_BYTES = 64*1024**2
 
     @staticmethod
     def mm2pix(args):
-        return [x*(CardPDFWriter.RESOLUTION/25.4) for x in args]
-    
-    def __init__(self, file_name, card_format, paper_format, separation=[0.8, 0.8]):
+        return [x*(CardSheetWriter.RESOLUTION/25.4) for x in args]
+
+    def __init__(self, card_format, paper_format, separation=[0.8, 0.8], resample=Resample.SMOOTH, keep_images=True,
+                 packing="Upright", cut_lines="Full", line_width=1, profile=None):
         self.cardFormat = self.mm2pix(card_format)
         self.paperFormat = self.mm2pix(paper_format)
         self.separation = self.mm2pix(separation)
         self.paperFormatMM = paper_format
+        self.separationMM = separation
+        self.resample = Resample(resample)
+        # Card images are resampled to the profile DPI, the page layout always uses RESOLUTION
+        profile = {**DEFAULT_PROFILE, **(profile or {})}
+        self.imageDPI = profile["DPI"]
+        self.imageEncoding = profile["Image Encoding"]
+        self.imageQuality = profile["Quality"]
+        self.compression = profile["Compression"]
+        # Pixels actually needed to fill a card slot at the image resolution
+        self.slotSize = self.imageSize(card_format)
+
+        self.layout = get_layout(card_format, paper_format, separation, self.RESOLUTION, packing)
+        self.bleeding = self.layout.bleeding
+        # Cards drawn so far, the layout gives the page and slot of the next one
+        self.placed = 0
+        self.pageCount = 1
+        # Cut lines are drawn along with the first card of each page, so the layout can
+        # still be replaced (addPackedCards) before anything is drawn
+        self.pageReady = False
+        # One of layout.CUT_LINES, the width is in mm
+        self.cutLines = cut_lines
+        self.lineWidth = int(self.mm2pix([line_width])[0])
+
+        # content hash -> shared (resampled) image, cacheKey -> content hash
+        self.images = {}
+        self._digests = {}
+        # Without keep_images each card is released once its copies are drawn, so memory
+        # stays flat on big orders, only the last RECENT_BYTES of them stay for repeats
+        self.keepImages = keep_images
+        # Released content hash -> bytes, oldest first
+        self._recent = OrderedDict()
+        # Decodes cards given as paths, e.g. ImageStore.get to reuse already decoded images
+        self.loader = None
+        # Resampled images of cards given as paths from earlier exports, a render_cache.RenderCache
+        self.renderCache = None
+        # Slot size of the cards that don't use card_format, by card key
+        self.slotSizes = {}
+        # Stage events (decode, scale, draw, flush...) for whoever adds an observer
+        self.recorder = Recorder()
+        # Set from any thread to stop adding cards, can be replaced by a shared event
+        self.cancelled = threading.Event()
+
+    def imageSize(self, card_format):
+        return [round(x*(self.imageDPI/25.4)) for x in card_format]
+
+    def _setupPage(self):
+        lines = self.layout.pageCutLines(self.pageCount-1, self.cutLines)
+        if lines:
+            self._drawCutLines(lines)
+        self.pageReady = True
+
+    def _drawCutLines(self, lines):
+        # Every page of a layout gets the very same lines tuple, engines can draw it once and reuse it
+        for line in lines:
+            self._drawLine(QPointF(line.x1, line.y1), QPointF(line.x2, line.y2))
+
+    def _ensurePage(self):
+        if not self.pageReady:
+            self._setupPage()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _drawLine(self, p1, p2):
+        raise NotImplementedError
+
+    def _drawCard(self, rect, card, rotation=0):
+        # rect is the slot on the page, turned cards fill it rotated 90 degrees clockwise
+        raise NotImplementedError
+
+    def _newPage(self):
+        raise NotImplementedError
+
+    def _written(self):
+        # Bytes of the PDF written so far
+        raise NotImplementedError
+
+    def _flushTimed(self, flush):
+        with self.recorder.stage("flush", self.pageCount) as span:
+            start = self._written()
+            flush()
+            span.bytes = self._written() - start
+
+    @assert_file_open
+    def addPage(self):
+        # An empty page still gets its cut lines
+        self._ensurePage()
+        self._flushTimed(self._newPage)
+        self.pageCount += 1
+        self.pageReady = False
+
+    @staticmethod
+    def _cardKey(card):
+        if isinstance(card, (str, Path)):
+            return str(card)
+        return type(card).__name__, card.cacheKey()
+
+    def _slotSize(self, card):
+        return self.slotSizes.get(self._cardKey(card), self.slotSize)
+
+    def _prepareCard(self, card):
+        # Runs on worker threads in addCards, so it must not touch the writer state
+        size = self._slotSize(card)
+        if isinstance(card, (str, Path)):
+            if self.renderCache is not None and self._needsResample(QImageReader(str(card)).size(), size):
+                return self._cachedResample(str(card), size)
+            card = self._loadImage(str(card))
+        return self._sizedDigest(image_digest(card), size), self._resampled(card, size)
+
+    def _needsResample(self, source, size):
+        # source is a QSize, invalid when the header can't be read
+        return (self.resample is not Resample.NONE and source.isValid()
+                and (source.width() > size[0] or source.height() > size[1]))
+
+    def _cachedResample(self, path, size):
+        # The raw pixels are kept, reading them back is many times faster than decoding and resampling
+        # (compressing them costs about as much as it saves on real card art)
+        key = self.renderCache.key(hashlib.sha1(Path(path).read_bytes()).hexdigest(), size, self.imageDPI,
+                                   f"{self.resample.name}/QImage")
+        rendered = []
+
+        def render():
+            img = self._loadImage(path)
+            digest = self._sizedDigest(image_digest(img), size)
+            img = self._resampled(img, size)
+            rendered.append((digest, img))
+            bits = img.constBits()
+            bits.setsize(img.sizeInBytes())
+            return dict(width=img.width(), height=img.height(), bytesPerLine=img.bytesPerLine(),
+                        format=int(img.format()), digest=digest), bits.asstring()
+        params, data = self._cached(key, render, path)
+        if rendered:
+            return rendered[0]
+        img = QImage(data, params["width"], params["height"], params["bytesPerLine"], QImage.Format(params["format"]))
+        # The QImage only points into data until copied
+        return params["digest"], img.copy()
+
+    def _cached(self, key, render, item=None):
+        """(params, data) of key in the render cache, or the ones render() returns, which are put there.
+        The key is claimed meanwhile, so parallel exports render every image once."""
+        hit = self.renderCache.get(key)
+        if hit is None and not self.renderCache.claim(key):
+            # Another export (e.g. a parallel job) is rendering the very same image
+            hit = self.renderCache.wait(key)
+        if hit is not None:
+            self.recorder.emit("cache-hit", nbytes=len(hit[1]), item=item)
+            return hit
+        self.recorder.emit("cache-miss", item=item)
+        try:
+            params, data = render()
+        except:
+            self.renderCache.release(key)
+            raise
+        self.renderCache.put(key, params, data)
+        return params, data
+
+    def _sizedDigest(self, digest, size):
+        # The same picture resampled for another card format is another image
+        return f"{digest}@{size[0]}x{size[1]}"
+
+    def _loadImage(self, path):
+        with self.recorder.stage("decode", path) as span:
+            img = self.loader(path) if self.loader is not None else QImage(path)
+            if img.isNull():
+                raise ValueError(f"Could not load image {path}")
+            span.bytes = img.sizeInBytes()
+        return img
+
+    def _store(self, prepared):
+        return prepared
+
+    def _addPrepared(self, key, digest, prepared):
+        self._digests[key] = digest
+        if digest not in self.images:
+            self.images[digest] = self._store(prepared)
+
+    def _sharedImage(self, card):
+        # PDF engines embed one image object per shared card, so every copy of the same
+        # content must be drawn from the very same object to be written only once
+        key = self._cardKey(card)
+        if key not in self._digests:
+            self._addPrepared(key, *self._prepareCard(card))
+        return self.images[self._digests[key]]
+
+    def _forget(self, key):
+        digest = self._digests.pop(key, None)
+        if digest is None or digest in self._digests.values():
+            return
+        image = self.images[digest]
+        self._recent.pop(digest, None)
+        self._recent[digest] = image.width()*image.height()*image.depth()//8
+        total = sum(self._recent.values())
+        while total > self.RECENT_BYTES:
+            oldest, nbytes = self._recent.popitem(last=False)
+            total -= nbytes
+            if oldest not in self._digests.values():
+                self.images.pop(oldest, None)
+
+    def _resampled(self, card, size=None):
+        # Only downsample, upscaling would just bloat the file without adding detail
+        w, h = size or self.slotSize
+        if self.resample is Resample.NONE or (card.width() <= w and card.height() <= h):
+            return card
+        with self.recorder.stage("scale") as span:
+            card = card.scaled(w, h, Qt.IgnoreAspectRatio, self.resample.value)
+            span.bytes = card.sizeInBytes()
+        return card
+
+    @assert_file_open
+    def addCard(self, card, num_copies):
+        if num_copies <= 0:
+            return
+        key = self._cardKey(card)
+        card = self._sharedImage(card)
+        for _ in range(num_copies):
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            page, slot = self.layout.slotAt(self.placed)
+            while self.pageCount <= page:
+                self.addPage()
+            self._ensurePage()
+            with self.recorder.stage("draw", key):
+                self._drawCard(QRectF(slot.x, slot.y, slot.width, slot.height), card, slot.rotation)
+            self.placed += 1
+        if not self.keepImages:
+            self._forget(key)
+
+    @assert_file_open
+    def addCards(self, cards, workers=None):
+        """Same as calling addCard for every (card, num_copies) pair, but decoding and
+        resampling of the unique images is spread over `workers` threads."""
+        workers = workers or os.cpu_count() or 1
+        self.addCardStream(cards, 2*workers, workers)
+
+    @assert_file_open
+    def addPackedCards(self, cards, formats, workers=None):
+        """Lays out (card, num_copies) pairs where every card has its own format (in mm),
+        packed together with PackedLayout. Has to be called before any other card is added."""
+        if self.placed:
+            raise ValueError("Packed cards have to be laid out from the first card")
+        cards = list(cards)
+        self.layout = PackedLayout(formats, [num_copies for _, num_copies in cards], self.paperFormatMM,
+                                   self.separationMM, self.RESOLUTION)
+        for (card, _), card_format in zip(cards, formats):
+            self.slotSizes[self._cardKey(card)] = self.imageSize(card_format)
+        # The layout expects every card in its own order
+        self.addCards([cards[it] for it in self.layout.order], workers)
+
+    @assert_file_open
+    def addCardStream(self, entries, prefetch=4, workers=1):
+        """Lays out (card, num_copies) pairs from any iterable, a generator can be endless.
+
+        A background thread pulls the entries and starts decoding up to `prefetch` cards
+        ahead while the current ones are drawn, finished pages are written right away.
+        With keep_images=False memory stays around one page plus the prefetch window."""
+        window = Queue(maxsize=max(1, prefetch))
+        stop = threading.Event()
+        end = object()
+
+        def produce(pool):
+            try:
+                for card, num_copies in entries:
+                    if stop.is_set() or self.cancelled.is_set():
+                        return
+                    future = None
+                    # QPixmaps can only be used from the GUI thread, addCard decodes those
+                    if num_copies > 0 and not isinstance(card, QPixmap) and self._cardKey(card) not in self._digests:
+                        future = pool.submit(self._prepareCard, card)
+                    window.put((card, num_copies, future))
+            except BaseException as e:
+                window.put(e)
+            finally:
+                window.put(end)
+
+        with ThreadPoolExecutor(workers) as pool:
+            producer = threading.Thread(target=produce, args=(pool,), daemon=True)
+            producer.start()
+            try:
+                while True:
+                    item = window.get()
+                    if item is end:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    card, num_copies, future = item
+                    if future is not None:
+                        key = self._cardKey(card)
+                        prepared = future.result()
+                        if key not in self._digests:
+                            self._addPrepared(key, *prepared)
+                    self.addCard(card, num_copies)
+                if self.cancelled.is_set():
+                    raise ExportCancelled()
+            finally:
+                stop.set()
+                # Unblock the producer if it is waiting for room in the window
+                while producer.is_alive():
+                    while not window.empty():
+                        window.get_nowait()
+                    producer.join(0.05)
+
+    def _releaseImages(self):
+        self.images.clear()
+        self._digests.clear()
+        self._recent.clear()
+
+class CardPDFWriter(CardSheetWriter):
+    def __init__(self, file_name, card_format, paper_format, separation=[0.8, 0.8], resample=Resample.SMOOTH, keep_images=True,
+                 packing="Upright", cut_lines="Full", line_width=1, profile=None):
+        # QPdfWriter picks the encoding of the images itself, only the profile DPI applies
+        super().__init__(card_format, paper_format, separation, resample, keep_images, packing, cut_lines, line_width, profile)
         self.file = QFile(str(file_name))
         self.file.open(QIODevice.WriteOnly)
 
@@ -32,56 +377,56 @@ class CardPDFWriter:
 
         self.painter = QPainter(self.writer)
         self.pen = QPen()
-        self.pen.setWidth(int(self.mm2pix([1])[0]))
+        self.pen.setWidth(self.lineWidth)
         self.painter.setPen(self.pen)
-        
-        self.bleeding = [0,0]
-        self.bleeding[0] = (self.paperFormat[0] % int(self.cardFormat[0] + self.separation[0]))/2
-        self.bleeding[1] = (self.paperFormat[1] % int(self.cardFormat[1] + self.separation[1]))/2
-        self.cursor = self.bleeding[:]
-
-        self._setupPage()
-    
-    def _setupPage(self):
-        # self.writer.setPageSizeMM(QSizeF(*self.paperFormatMM))
-        # self.writer.setPageMargins(QMarginsF(0, 0, 0, 0))
-        # Horizontal lines
-        pos = self.bleeding[0] - self.separation[0]/2
-        while (pos < self.paperFormat[0]):
-            self.painter.drawLine(QPointF(pos, 0) , QPointF(pos, self.paperFormat[1]))
-            pos += self.cardFormat[0] + self.separation[0]
-        
-        # Vertical lines
-        pos = self.bleeding[1] - self.separation[1]/2
-        while (pos < self.paperFormat[1]):
-            self.painter.drawLine(QPointF(0, pos), QPointF(self.paperFormat[0], pos))
-            pos += self.cardFormat[1] + self.separation[1]
+        self._lineCache = {}
 
-    @assert_file_open
-    def addPage(self):
+    def _drawLine(self, p1, p2):
+        self.painter.drawLine(p1, p2)
+
+    def _drawCutLines(self, lines):
+        # QPdfWriter can't share a drawing between pages, the lines are only built once per layout
+        qlines = self._lineCache.get(lines)
+        if qlines is None:
+            qlines = self._lineCache[lines] = [QLineF(*line) for line in lines]
+        self.painter.drawLines(qlines)
+
+    def _drawCard(self, rect, card, rotation=0):
+        source = QRectF(0,0, card.width(), card.height())
+        if rotation:
+            self.painter.save()
+            self.painter.translate(rect.right(), rect.top())
+            self.painter.rotate(rotation)
+            rect = QRectF(0, 0, rect.height(), rect.width())
+        if isinstance(card, QImage):
+            self.painter.drawImage(rect, card, source)
+        else:
+            self.painter.drawPixmap(rect, card, source)
+        if rotation:
+            self.painter.restore()
+
+    def _newPage(self):
         self.writer.newPage()
-        self._setupPage()
 
-    @assert_file_open
-    def addCard(self, card, num_copies):
-        for _ in range(num_copies):
-            if self.cursor[1] > (self.paperFormat[1] - self.bleeding[1] - self.cardFormat[1]):
-                self.cursor = self.bleeding[:]
-                self.addPage()
-        
-            self.painter.drawPixmap(QRectF(*self.cursor, *self.cardFormat), card, QRectF(0,0, card.width(), card.height()))
-            # self.painter.drawPixmap(*self.cursor, *self.cardFormat, card)
-            self.cursor[0] += self.cardFormat[0] + self.separation[0]
-
-            if self.cursor[0] > (self.paperFormat[0] - self.bleeding[0] - self.cardFormat[0]):
-                self.cursor[0] = self.bleeding[0]
-                self.cursor[1] += self.cardFormat[1] + self.separation[1]
-                
-    
+    def _written(self):
+        return self.file.pos()
+
     @assert_file_open
     def close(self):
-        self.painter.end()
+        self._ensurePage()
+        self._flushTimed(self.painter.end)
+        self._releaseImages()
         self.file.flush()
         self.file.close()
-    
+        if self.renderCache is not None:
+            self.renderCache.save()
+
+    @assert_file_open
+    def abort(self):
+        """Stops writing and removes the unfinished PDF."""
+        self.painter.end()
+        self._releaseImages()
+        self.file.close()
+        self.file.remove()
+
     def isOpen(self): return self.file.isOpen()
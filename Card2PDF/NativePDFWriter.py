@@ -0,0 +1,365 @@
+import hashlib, json, os, zlib
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage, QPainter
+
+from CardPDFWriter import DEFAULT_PROFILE, CardSheetWriter, Resample, assert_file_open, image_digest
+from pic_cache import atomic_write
+
+# SOFn markers, C4 (DHT), C8 (JPG) and CC (DAC) share the range but are not frames
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def jpeg_info(data):
+    """Returns (width, height, components, adobe) of a JPEG stream or None if it isn't one."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    adobe = False
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos+1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = int.from_bytes(data[pos+2:pos+4], "big")
+        if marker == 0xEE and data[pos+4:pos+9] == b"Adobe":
+            adobe = True
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[pos+5:pos+7], "big")
+            width = int.from_bytes(data[pos+7:pos+9], "big")
+            return width, height, data[pos+9], adobe
+        if marker == 0xDA:
+            return None
+        pos += 2 + length
+    return None
+
+class PDFImage:
+    COLOR_SPACES = {1: b"/DeviceGray", 3: b"/DeviceRGB", 4: b"/DeviceCMYK"}
+
+    def __init__(self, width, height, components, data, filter_name, inverted=False):
+        self.width = width
+        self.height = height
+        self.components = components
+        self.data = data
+        self.filter = filter_name
+        self.inverted = inverted
+        self.name = None
+        self.digest = None
+        # Key of the source file in the layout manifest
+        self.source = None
+
+    @classmethod
+    def fromJPEG(cls, data, info=None):
+        width, height, components, adobe = info or jpeg_info(data)
+        # Adobe CMYK JPEGs are stored inverted
+        return cls(width, height, components, data, b"/DCTDecode", adobe and components == 4)
+
+    @classmethod
+    def fromQImage(cls, img, lossless=True, quality=DEFAULT_PROFILE["Quality"], level=DEFAULT_PROFILE["Compression"]):
+        if img.hasAlphaChannel():
+            # PDF has no notion of the alpha channel of a plain image, flatten over white paper
+            flat = QImage(img.size(), QImage.Format_RGB888)
+            flat.fill(Qt.white)
+            painter = QPainter(flat)
+            painter.drawImage(0, 0, img)
+            painter.end()
+            img = flat
+        else:
+            img = img.convertToFormat(QImage.Format_RGB888)
+        if not lossless:
+            buf = QByteArray()
+            dev = QBuffer(buf)
+            dev.open(QIODevice.WriteOnly)
+            img.save(dev, "JPG", quality)
+            return cls.fromJPEG(bytes(buf))
+        bits = img.constBits()
+        bits.setsize(img.sizeInBytes())
+        raw = bits.asstring()
+        row = img.width()*3
+        if img.bytesPerLine() != row:
+            bpl = img.bytesPerLine()
+            raw = b"".join(raw[y*bpl:y*bpl+row] for y in range(img.height()))
+        return cls(img.width(), img.height(), 3, zlib.compress(raw, level), b"/FlateDecode")
+
+    def params(self):
+        return dict(width=self.width, height=self.height, components=self.components,
+                    filter=self.filter.decode(), inverted=self.inverted)
+
+    @classmethod
+    def fromParams(cls, params, data):
+        return cls(params["width"], params["height"], params["components"], data,
+                   params["filter"].encode(), params["inverted"])
+
+    def setDigest(self, digest):
+        self.digest = digest
+        # Named after the content, the same page always gets the very same content stream
+        self.name = b"Im" + hashlib.sha1(digest.encode()).hexdigest()[:16].encode()
+
+    def dictionary(self):
+        entries = [b"/Type /XObject /Subtype /Image",
+                   b"/Width %d /Height %d" % (self.width, self.height),
+                   b"/ColorSpace " + self.COLOR_SPACES[self.components],
+                   b"/BitsPerComponent 8",
+                   b"/Filter " + self.filter,
+                   b"/Length %d" % len(self.data)]
+        if self.inverted:
+            entries.append(b"/Decode [" + b"1 0 "*self.components + b"]")
+        return b"<< " + b" ".join(entries) + b" >>"
+
+class CopiedObject:
+    """Body of an image object of the previous export, copied as it is."""
+    def __init__(self, source, entry, body):
+        self.source = source
+        self.digest = entry["digest"]
+        self.name = entry["name"].encode()
+        self.body = body
+
+class PreviousExport:
+    """The manifest an export leaves next to its PDF: where every image object and page content
+    stream is in that PDF, so the next export of the same file can copy whatever didn't change."""
+    VERSION = 1
+
+    def __init__(self, pdf_path, manifest):
+        self.pdfPath = pdf_path
+        self.images = manifest["images"]
+        self.pages = {page["content"]: page for page in manifest["pages"]}
+
+    @staticmethod
+    def manifestPath(pdf_path):
+        return Path(pdf_path).with_suffix(".layout.json")
+
+    @staticmethod
+    def stamp(pdf_path):
+        st = os.stat(pdf_path)
+        return [st.st_size, st.st_mtime_ns]
+
+    @classmethod
+    def load(cls, pdf_path):
+        """None unless the manifest describes the PDF currently on disk."""
+        try:
+            manifest = json.loads(cls.manifestPath(pdf_path).read_text())
+            if manifest.get("version") != cls.VERSION or manifest["pdf"] != cls.stamp(pdf_path):
+                return None
+            return cls(pdf_path, manifest)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def read(self, offset, length):
+        # Called from the worker threads, each read gets its own handle
+        with open(self.pdfPath, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+class NativePDFWriter(CardSheetWriter):
+    """Writes the PDF directly, JPEG sources given by path are embedded byte for byte.
+
+    Next to the PDF goes a layout manifest, exporting to the same file again copies the image
+    objects and page contents that didn't change from the previous PDF instead of rebuilding them."""
+    def __init__(self, file_name, card_format, paper_format, separation=[0.8, 0.8], resample=Resample.SMOOTH, keep_images=True,
+                 packing="Upright", cut_lines="Full", line_width=1, profile=None):
+        super().__init__(card_format, paper_format, separation, resample, keep_images, packing, cut_lines, line_width, profile)
+        self.path = Path(file_name)
+        self.previous = PreviousExport.load(self.path)
+        self.manifest = dict(version=PreviousExport.VERSION, images={}, pages=[])
+        self.reusedPages = 0
+        # The previous PDF is read until the new one is complete
+        self.tmpPath = self.path.with_name(f".{self.path.name}.tmp-{os.getpid()}")
+        self.file = open(self.tmpPath, "wb")
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.offsets = {}
+        self.nextObj = 3 # 1 is the page tree and 2 the catalog, both written on close
+        self.pages = []
+        self.pageWidth, self.pageHeight = self.px2pt(self.paperFormat)
+        # Cut lines of a layout page are written once as a form, drawn by every page with the same lines
+        self.templates = {}
+
+        self._startPage()
+
+    @staticmethod
+    def px2pt(args):
+        return [x*72/CardSheetWriter.RESOLUTION for x in args]
+
+    def _allocObj(self):
+        num = self.nextObj
+        self.nextObj += 1
+        return num
+
+    def _writeObj(self, num, body, stream=None):
+        """Returns the offset and length of everything between `obj` and `endobj`."""
+        self.offsets[num] = self.file.tell()
+        self.file.write(b"%d 0 obj\n" % num)
+        start = self.file.tell()
+        self.file.write(body)
+        if stream is not None:
+            self.file.write(b"\nstream\n" + stream + b"\nendstream")
+        end = self.file.tell()
+        self.file.write(b"\nendobj\n")
+        return start, end - start
+
+    def _startPage(self):
+        self.content = []
+        # Every XObject the page draws, card images and cut line forms
+        self.pageImages = {}
+
+    def _flushPage(self):
+        content = b"\n".join(self.content)
+        digest = hashlib.sha1(content).hexdigest()
+        content_num = self._allocObj()
+        old = self.previous.pages.get(digest) if self.previous else None
+        if old is not None:
+            self.reusedPages += 1
+            offset, length = self._writeObj(content_num, self.previous.read(old["offset"], old["length"]))
+        else:
+            content = zlib.compress(content, self.compression)
+            offset, length = self._writeObj(content_num, b"<< /Length %d /Filter /FlateDecode >>" % len(content), content)
+        self.manifest["pages"].append(dict(content=digest, offset=offset, length=length))
+        xobjects = b" ".join(b"/%s %d 0 R" % (name, num) for name, num in self.pageImages.items())
+        page_num = self._allocObj()
+        self._writeObj(page_num, b"<< /Type /Page /Parent 1 0 R /MediaBox [0 0 %.3f %.3f] "
+                       b"/Resources << /XObject << %s >> >> /Contents %d 0 R >>"
+                       % (self.pageWidth, self.pageHeight, xobjects, content_num))
+        self.pages.append(page_num)
+
+    def _drawCutLines(self, lines):
+        if lines not in self.templates:
+            ops = [b"%.3f w 2 J 0 G" % self.px2pt([self.lineWidth])[0]]
+            for line in lines:
+                x1, y1, x2, y2 = self.px2pt(line)
+                ops.append(b"%.3f %.3f m %.3f %.3f l S" % (x1, self.pageHeight-y1, x2, self.pageHeight-y2))
+            stream = zlib.compress(b"\n".join(ops), self.compression)
+            num = self._allocObj()
+            self._writeObj(num, b"<< /Type /XObject /Subtype /Form /BBox [0 0 %.3f %.3f] /Length %d /Filter /FlateDecode >>"
+                           % (self.pageWidth, self.pageHeight, len(stream)), stream)
+            self.templates[lines] = (b"Cut" + hashlib.sha1(stream).hexdigest()[:16].encode(), num)
+        name, num = self.templates[lines]
+        self.pageImages[name] = num
+        self.content.append(b"/%s Do" % name)
+
+    def _drawCard(self, rect, card, rotation=0):
+        num, image = card
+        self.pageImages[image.name] = num
+        x, y, w, h = self.px2pt([rect.x(), rect.y(), rect.width(), rect.height()])
+        if rotation:
+            # Image top along the right side of the slot
+            self.content.append(b"q 0 %.3f %.3f 0 %.3f %.3f cm /%s Do Q" % (-h, w, x, self.pageHeight-y, image.name))
+        else:
+            self.content.append(b"q %.3f 0 0 %.3f %.3f %.3f cm /%s Do Q" % (w, h, x, self.pageHeight-y-h, image.name))
+
+    def _newPage(self):
+        self._flushPage()
+        self._startPage()
+
+    def _written(self):
+        return self.file.tell()
+
+    def _prepareCard(self, card):
+        size = self._slotSize(card)
+        if isinstance(card, (str, Path)):
+            source = self._sourceKey(card, size)
+            old = self.previous.images.get(source) if self.previous else None
+            if old is not None:
+                self.recorder.emit("cache-hit", nbytes=old["length"], item=card)
+                return old["digest"], CopiedObject(source, old, self.previous.read(old["offset"], old["length"]))
+            data = Path(card).read_bytes()
+            digest = hashlib.sha1(data).hexdigest()
+            image = self._loadFile(data, size, digest)
+            image.source = source
+        else:
+            if not isinstance(card, QImage):
+                card = card.toImage()
+            digest = image_digest(card)
+            image = self._rendered(digest, size, lambda: self._encode(self._resampled(card, size), False))
+        image.setDigest(self._sizedDigest(digest, size))
+        return image.digest, image
+
+    def _sourceKey(self, path, size):
+        # Whatever the embedded image depends on, a changed file gets a new key
+        st = os.stat(path)
+        return f"{Path(path).resolve()}|{st.st_mtime_ns}|{st.st_size}|{size[0]}x{size[1]}|{self._encoding()}"
+
+    def _forget(self, key):
+        # Shared entries are only an object number once embedded, keeping them costs nothing
+        pass
+
+    def _loadFile(self, data, size=None, digest=None):
+        info = jpeg_info(data)
+        size = size or self.slotSize
+        if info is not None and (self.resample is Resample.NONE or (info[0] <= size[0] and info[1] <= size[1])):
+            return PDFImage.fromJPEG(data, info)
+
+        def encode():
+            with self.recorder.stage("decode") as span:
+                img = QImage.fromData(data)
+                if img.isNull():
+                    raise ValueError("Could not decode card image")
+                span.bytes = img.sizeInBytes()
+            return self._encode(self._resampled(img, size), info is not None)
+        return self._rendered(digest or hashlib.sha1(data).hexdigest(), size, encode)
+
+    def _encoding(self):
+        return f"{self.resample.name}/{self.imageEncoding}/{self.imageQuality}/{self.compression}"
+
+    def _encode(self, img, from_jpeg):
+        # Auto keeps a resampled JPEG lossy, it has to be encoded again anyway
+        lossless = self.imageEncoding == "Flate" or (self.imageEncoding == "Auto" and not from_jpeg)
+        with self.recorder.stage("encode") as span:
+            image = PDFImage.fromQImage(img, lossless, self.imageQuality, self.compression)
+            span.bytes = len(image.data)
+        return image
+
+    def _rendered(self, digest, size, encode):
+        # Decoding, resampling and encoding are skipped when an earlier export already did them
+        if self.renderCache is None:
+            return encode()
+        key = self.renderCache.key(digest, size, self.imageDPI, self._encoding())
+        encoded = []
+
+        def render():
+            encoded.append(encode())
+            return encoded[0].params(), encoded[0].data
+        params, data = self._cached(key, render)
+        return encoded[0] if encoded else PDFImage.fromParams(params, data)
+
+    def _store(self, image):
+        num = self._allocObj()
+        if isinstance(image, CopiedObject):
+            offset, length = self._writeObj(num, image.body)
+            image.body = None
+        else:
+            offset, length = self._writeObj(num, image.dictionary(), image.data)
+            image.data = None
+        if image.source is not None:
+            self.manifest["images"][image.source] = dict(digest=image.digest, name=image.name.decode(),
+                                                         offset=offset, length=length)
+        return num, image
+
+    @assert_file_open
+    def close(self):
+        self._ensurePage()
+        self._flushTimed(self._flushPage)
+        kids = b" ".join(b"%d 0 R" % num for num in self.pages)
+        self._writeObj(1, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)))
+        self._writeObj(2, b"<< /Type /Catalog /Pages 1 0 R >>")
+        xref = self.file.tell()
+        self.file.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.nextObj)
+        for num in range(1, self.nextObj):
+            self.file.write(b"%010d 00000 n \n" % self.offsets[num])
+        self.file.write(b"trailer\n<< /Size %d /Root 2 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.nextObj, xref))
+        self._releaseImages()
+        self.file.close()
+        os.replace(self.tmpPath, self.path)
+        self.manifest["pdf"] = PreviousExport.stamp(self.path)
+        atomic_write(PreviousExport.manifestPath(self.path), json.dumps(self.manifest, separators=(",", ":")).encode())
+        if self.renderCache is not None:
+            self.renderCache.save()
+
+    @assert_file_open
+    def abort(self):
+        """Stops writing, the previous PDF and its manifest (if any) stay as they were."""
+        self._releaseImages()
+        self.file.close()
+        self.tmpPath.unlink(missing_ok=True)
+
+    def isOpen(self): return not self.file.closed
@@ -35,24 +35,18 @@ class Ui_MainWindow(object):
         self.verticalLayout_2.addWidget(self.label_3)
         self.horizontalLayout = QtWidgets.QHBoxLayout()
         self.horizontalLayout.setObjectName("horizontalLayout")
-        self.tableWidget = QtWidgets.QTableWidget(self.centralwidget)
+        self.tableView = QtWidgets.QTableView(self.centralwidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.MinimumExpanding, QtWidgets.QSizePolicy.MinimumExpanding)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
-        sizePolicy.setHeightForWidth(self.tableWidget.sizePolicy().hasHeightForWidth())
-        self.tableWidget.setSizePolicy(sizePolicy)
-        self.tableWidget.setMinimumSize(QtCore.QSize(400, 0))
-        self.tableWidget.setStyleSheet("font: 75 10pt \"MS Shell Dlg 2\";")
-        self.tableWidget.setObjectName("tableWidget")
-        self.tableWidget.setColumnCount(3)
-        self.tableWidget.setRowCount(0)
-        item = QtWidgets.QTableWidgetItem()
-        self.tableWidget.setHorizontalHeaderItem(0, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.tableWidget.setHorizontalHeaderItem(1, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.tableWidget.setHorizontalHeaderItem(2, item)
-        self.horizontalLayout.addWidget(self.tableWidget)
+        sizePolicy.setHeightForWidth(self.tableView.sizePolicy().hasHeightForWidth())
+        self.tableView.setSizePolicy(sizePolicy)
+        self.tableView.setMinimumSize(QtCore.QSize(400, 0))
+        self.tableView.setStyleSheet("font: 75 10pt \"MS Shell Dlg 2\";")
+        self.tableView.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.tableView.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.tableView.setObjectName("tableView")
+        self.horizontalLayout.addWidget(self.tableView)
         spacerItem = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Minimum)
         self.horizontalLayout.addItem(spacerItem)
         self.verticalLayout = QtWidgets.QVBoxLayout()
@@ -129,6 +123,24 @@ class Ui_MainWindow(object):
         self.cardComboBox.setMinimumContentsLength(20)
         self.cardComboBox.setObjectName("cardComboBox")
         self.verticalLayout.addWidget(self.cardComboBox)
+        self.label_4 = QtWidgets.QLabel(self.centralwidget)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Maximum)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.label_4.sizePolicy().hasHeightForWidth())
+        self.label_4.setSizePolicy(sizePolicy)
+        self.label_4.setMaximumSize(QtCore.QSize(16777215, 50))
+        self.label_4.setObjectName("label_4")
+        self.verticalLayout.addWidget(self.label_4)
+        self.profileComboBox = QtWidgets.QComboBox(self.centralwidget)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Maximum)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.profileComboBox.sizePolicy().hasHeightForWidth())
+        self.profileComboBox.setSizePolicy(sizePolicy)
+        self.profileComboBox.setMaximumSize(QtCore.QSize(16777215, 50))
+        self.profileComboBox.setObjectName("profileComboBox")
+        self.verticalLayout.addWidget(self.profileComboBox)
         self.exportButton = QtWidgets.QPushButton(self.centralwidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Maximum)
         sizePolicy.setHorizontalStretch(0)
@@ -160,7 +172,8 @@ class Ui_MainWindow(object):
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
         MainWindow.setTabOrder(self.clearButton, self.addCardsButton)
         MainWindow.setTabOrder(self.addCardsButton, self.cardComboBox)
-        MainWindow.setTabOrder(self.cardComboBox, self.exportButton)
+        MainWindow.setTabOrder(self.cardComboBox, self.profileComboBox)
+        MainWindow.setTabOrder(self.profileComboBox, self.exportButton)
 
     def retranslateUi(self, MainWindow):
         _translate = QtCore.QCoreApplication.translate
@@ -170,18 +183,14 @@ class Ui_MainWindow(object):
 "p, li { white-space: pre-wrap; }\n"
 "</style></head><body style=\" font-family:\'MS Shell Dlg 2\'; font-size:8pt; font-weight:400; font-style:normal;\">\n"
 "<p style=\" margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><img src=\":/icons/resources/Icon.png\" height=\"60\" width=\"60\"/><span style=\" font-size:22pt; font-weight:600;\">  Card2PDF</span></p></body></html>"))
-        item = self.tableWidget.horizontalHeaderItem(0)
-        item.setText(_translate("MainWindow", "Name"))
-        item = self.tableWidget.horizontalHeaderItem(1)
-        item.setText(_translate("MainWindow", "# Copies"))
-        item = self.tableWidget.horizontalHeaderItem(2)
-        item.setText(_translate("MainWindow", "Preview"))
         self.clearButton.setText(_translate("MainWindow", "Clear List"))
         self.removeCardsButton.setText(_translate("MainWindow", "Remove Cards"))
         self.addCardsButton.setText(_translate("MainWindow", "Add Cards"))
         self.label_2.setText(_translate("MainWindow", "<html><head/><body><p align=\"center\"><span style=\" font-size:14pt; font-weight:600;\">Paper Format:</span></p></body></html>"))
         self.label.setText(_translate("MainWindow", "<html><head/><body><p align=\"center\"><span style=\" font-size:14pt; font-weight:600;\">Card Format:</span></p></body></html>"))
         self.cardComboBox.setToolTip(_translate("MainWindow", "<html><head/><body><p>Different TCG, DIfferent Card Dimensions.<br>Choose wisely.</p></body></html>"))
+        self.label_4.setText(_translate("MainWindow", "<html><head/><body><p align=\"center\"><span style=\" font-size:14pt; font-weight:600;\">Export Profile:</span></p></body></html>"))
+        self.profileComboBox.setToolTip(_translate("MainWindow", "Resolution, encoding and compression of the card images, from \"Export Profiles\" in Settings.json"))
         self.exportButton.setText(_translate("MainWindow", "Export to PDF!"))
         self.menuAbout.setTitle(_translate("MainWindow", "Abo&ut"))
         self.actionAbout.setText(_translate("MainWindow", "&About"))
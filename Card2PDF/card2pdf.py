@@ -0,0 +1,184 @@
+import argparse, multiprocessing, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# No window is ever shown, this lets it run on machines without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QGuiApplication
+
+from export_worker import ExportJob, run_export
+from layout import PACKINGS
+from render_cache import RenderCache
+from settings import PDF_ENGINES, RENDER_DIR, load_settings
+
+_app = None
+
+def _init_worker():
+    global _app
+    if QGuiApplication.instance() is None:
+        _app = QGuiApplication(["card2pdf"])
+
+def parse_manifest(path):
+    """Each line is an image path, optionally preceded by its number of copies: `3 pics/89631139.jpg`.
+    A `[Yugioh]` line sets the card format of the lines after it. Returns the cards and their format names,
+    None for the cards before any format line."""
+    path = Path(path)
+    cards, formats = [], []
+    card_format = None
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            card_format = line[1:-1].strip()
+            continue
+        copies, _, name = line.partition(" ")
+        if not copies.isdigit() or not name.strip():
+            copies, name = "1", line
+        img = Path(name.strip()).expanduser()
+        if not img.is_absolute():
+            img = path.parent/img
+        cards.append((str(img), int(copies)))
+        formats.append(card_format)
+    return cards, formats
+
+def deck_cards(code, settings):
+    from ygo_parser import PIC_CACHE, decode_ygo_deck, download_pic_by_id
+    from downloader import Downloader
+    PIC_CACHE.maxBytes = int(settings["Pic Cache MB"]*1024**2)
+    card2num = decode_ygo_deck(code)
+    paths = {}
+    try:
+        with Downloader(settings["Download Threads"], settings["Download Rate"]) as downloader:
+            for card_id, path in downloader.map(lambda card_id: download_pic_by_id(str(card_id), downloader), card2num):
+                if path is None:
+                    raise FileNotFoundError(f"Could not download card {card_id}")
+                paths[card_id] = str(path)
+    finally:
+        # Pictures downloaded before a failure are kept too
+        PIC_CACHE.save()
+    # Downloads finish in any order, keep the deck one
+    return [(paths[card_id], copies) for card_id, copies in card2num.items()]
+
+def export_job(job, settings, card_name, paper_name):
+    """Runs one (kind, source, out, profile) job in a pool process, returns the run_export report and its cards."""
+    kind, source, out, profile = job
+    if kind == "manifest":
+        cards, names = parse_manifest(source)
+    else:
+        cards = deck_cards(source, settings)
+        names = [None]*len(cards)
+    names = [name or card_name for name in names]
+    for name in names:
+        if name not in settings["Card Formats"]:
+            raise ValueError(f"unknown card format {name!r}")
+    paths = [path for path, _ in cards]
+    copies = [num_copies for _, num_copies in cards]
+    # Shared with the exports running in the other processes
+    render_cache = RenderCache(RENDER_DIR, int(settings["Render Cache MB"]*1024**2))
+    report = run_export(ExportJob(out, settings, paper_name, profile, paths, copies, names), render_cache=render_cache)
+    return dict(report, cards=sum(copies))
+
+def print_jobs():
+    from jobs import job_progress, read_jobs
+    jobs = read_jobs()
+    if not jobs:
+        print("No export jobs")
+        return 0
+    print(f"{'#':>4} {'state':<10} {'profile':<10} {'cards':>6}  pdf")
+    for job in jobs:
+        print(f"{job['id']:>4} {job['state']:<10} {job['profile']:<10} {job['cards']:>6}  {job['file']}  {job_progress(job)}")
+    return 0
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog="card2pdf", description="Export card images to a printable PDF without opening the GUI")
+    parser.add_argument("manifests", nargs="*", help="text files with one `[copies] image_path` entry per line")
+    parser.add_argument("-d", "--deck", action="append", default=[], help="YGOPro/Omega deck code, can be repeated")
+    parser.add_argument("-c", "--card", help="card format name from Settings.json")
+    parser.add_argument("-p", "--paper", help="paper format name from Settings.json")
+    parser.add_argument("-e", "--engine", choices=list(PDF_ENGINES), help="PDF engine, overrides Settings.json")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="export profile from Settings.json, repeat it to export every PDF with each profile")
+    parser.add_argument("--packing", choices=list(PACKINGS), help="card placement, overrides Settings.json")
+    parser.add_argument("-o", "--output-dir", help="where to write the PDFs, defaults to next to each manifest")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of PDFs exported in parallel")
+    parser.add_argument("--settings", help="alternative Settings.json")
+    parser.add_argument("--cache", choices=["gc", "verify", "stats"], help="maintenance of the downloaded card pictures")
+    parser.add_argument("--status", action="store_true", help="status of the export jobs of the running app")
+    return parser
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.status:
+        return print_jobs()
+    if args.cache:
+        import pic_cache
+        from ygo_parser import PIC_DIR
+        settings = load_settings(args.settings) if args.settings else load_settings()
+        return pic_cache.main([args.cache, "--max-mb", str(settings["Pic Cache MB"])], PIC_DIR)
+    if not args.manifests and not args.deck:
+        parser.error("nothing to export, give at least one manifest or --deck")
+    settings = load_settings(args.settings) if args.settings else load_settings()
+    if args.engine:
+        settings["PDF Engine"] = args.engine
+    if args.packing:
+        settings["Packing"] = args.packing
+    paper_name = args.paper or next(iter(settings["Paper Formats"]))
+    card_name = args.card or ("Yugioh" if args.deck and not args.manifests else next(iter(settings["Card Formats"])))
+    if paper_name not in settings["Paper Formats"]:
+        parser.error(f"unknown paper format {paper_name!r}, choose from {list(settings['Paper Formats'])}")
+    if card_name not in settings["Card Formats"]:
+        parser.error(f"unknown card format {card_name!r}, choose from {list(settings['Card Formats'])}")
+    profiles = list(dict.fromkeys(args.profile)) or [settings["Export Profile"]]
+    for profile in profiles:
+        if profile not in settings["Export Profiles"]:
+            parser.error(f"unknown export profile {profile!r}, choose from {list(settings['Export Profiles'])}")
+
+    out_dir = Path(args.output_dir) if args.output_dir else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    sources = []
+    for manifest in args.manifests:
+        out = Path(manifest).with_suffix(".pdf")
+        sources.append(("manifest", manifest, out_dir/out.name if out_dir else out))
+    for it, code in enumerate(args.deck):
+        sources.append(("deck", code, (out_dir or Path.cwd())/f"deck_{it+1}.pdf"))
+    jobs = []
+    for profile in profiles:
+        for kind, source, out in sources:
+            # With several profiles every one gets its own PDF, out.draft.pdf
+            if len(profiles) > 1:
+                out = out.with_suffix(f".{profile}.pdf")
+            jobs.append((kind, source, str(out), profile))
+
+    failed = 0
+    totals = {profile: dict(pdfs=0, seconds=0, bytes=0) for profile in profiles}
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(jobs))), initializer=_init_worker) as pool:
+        futures = [pool.submit(export_job, job, settings, card_name, paper_name) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                report = future.result()
+                cache = f", {report['reused']} pages unchanged" if report["reused"] else ""
+                print(f"{job[1][:40]} -> {report['file']} ({report['cards']} cards, {report['seconds']:.1f} s, "
+                      f"{report['bytes']/1024**2:.1f} MB{cache})")
+                print(f"    {report['stages']}")
+                total = totals[report["profile"]]
+                total["pdfs"] += 1
+                total["seconds"] += report["seconds"]
+                total["bytes"] += report["bytes"]
+            except Exception as e:
+                failed += 1
+                print(f"{job[1][:40]} failed: {e}", file=sys.stderr)
+    # Seconds are summed over the PDFs, jobs running in parallel overlap
+    for profile, total in totals.items():
+        if total["pdfs"]:
+            print(f"{profile}: {total['pdfs']} PDFs, {total['seconds']:.1f} s, {total['bytes']/1024**2:.1f} MB, "
+                  f"{total['bytes']/1024**2/max(total['seconds'], 1e-9):.1f} MB/s")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    # The export processes are spawned from the frozen exe too
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import hashlib, os
+from collections import defaultdict
+
+PREFIX_BYTES = 64*1024
+
+def normalize_path(path):
+    return os.path.normcase(os.path.realpath(str(path)))
+
+def _hash_file(path, limit=None):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        if limit is not None:
+            h.update(f.read(limit))
+        else:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                h.update(block)
+    return h.hexdigest()
+
+class CardIndex:
+    """Finds cards already in the list, by path or by content, in O(1).
+
+    Files are first bucketed by (size, hash of the first 64 KiB), only files that
+    share a bucket are ever fully hashed."""
+    def __init__(self):
+        self.byPath = {}
+        self.buckets = defaultdict(list)
+        self.quickKeys = {}
+        self.fullHashes = {}
+
+    def _fullHash(self, path):
+        if path not in self.fullHashes:
+            self.fullHashes[path] = _hash_file(path)
+        return self.fullHashes[path]
+
+    def _lookup(self, path):
+        norm = normalize_path(path)
+        if norm in self.byPath:
+            return self.byPath[norm], norm, None
+        try:
+            size = os.path.getsize(norm)
+            quick = (size, _hash_file(norm, PREFIX_BYTES))
+            for other in self.buckets.get(quick, ()):
+                # Whole file already read when it is smaller than the prefix
+                if size <= PREFIX_BYTES or self._fullHash(other) == self._fullHash(norm):
+                    return self.byPath[other], norm, quick
+        except OSError:
+            quick = None
+        return None, norm, quick
+
+    def add(self, path):
+        """Registers path unless it is a duplicate, returns the path of the existing card if it is."""
+        existing, norm, quick = self._lookup(path)
+        if existing is not None:
+            return existing
+        self.byPath[norm] = str(path)
+        if quick is not None:
+            self.buckets[quick].append(norm)
+            self.quickKeys[norm] = quick
+        return None
+
+    def remove(self, path):
+        norm = normalize_path(path)
+        self.byPath.pop(norm, None)
+        self.fullHashes.pop(norm, None)
+        quick = self.quickKeys.pop(norm, None)
+        if quick is not None:
+            bucket = self.buckets[quick]
+            bucket.remove(norm)
+            if not bucket:
+                del self.buckets[quick]
+
+    def __contains__(self, path):
+        return normalize_path(path) in self.byPath
+
+    def clear(self):
+        self.byPath.clear()
+        self.buckets.clear()
+        self.quickKeys.clear()
+        self.fullHashes.clear()
@@ -0,0 +1,218 @@
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QRect, pyqtSignal
+from PyQt5.QtWidgets import QComboBox, QStyledItemDelegate, QStyle
+
+from card_index import CardIndex
+
+NAME, COPIES, FORMAT, PREVIEW = range(4)
+HEADERS = ["Name", "# Copies", "Format", "Preview"]
+# Only this many thumbnails are held, the rest are reloaded (from the disk cache) when scrolled to
+MAX_THUMBNAILS = 2000
+
+class CardTableModel(QAbstractTableModel):
+    """Card list stored column wise: paths, copies, card format names, thumbnails by path and a path -> row index."""
+    thumbnailNeeded = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.paths = []
+        self.copies = array('l')
+        self.formats = []
+        # Names accepted in the format column
+        self.formatNames = []
+        self.rows = {}
+        self.cardIndex = CardIndex()
+        self.thumbnails = OrderedDict()
+        self._requested = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        flags = Qt.ItemIsSelectable|Qt.ItemIsEnabled
+        if index.column() in (COPIES, FORMAT):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if col == NAME and role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return Path(self.paths[row]).name if role == Qt.DisplayRole else self.paths[row]
+        if col == COPIES and role in (Qt.DisplayRole, Qt.EditRole):
+            return self.copies[row]
+        if col == FORMAT and role in (Qt.DisplayRole, Qt.EditRole):
+            return self.formats[row]
+        if col == PREVIEW and role == Qt.DecorationRole:
+            return self.thumbnail(self.paths[row])
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or index.column() not in (COPIES, FORMAT) or role != Qt.EditRole:
+            return False
+        if index.column() == FORMAT:
+            return self.setFormat([index.row()], value)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return False
+        if value < 0:
+            return False
+        self.copies[index.row()] = value
+        self.dataChanged.emit(index, index)
+        return True
+
+    def setFormat(self, rows, name):
+        if name not in self.formatNames:
+            return False
+        rows = [row for row in rows if self.formats[row] != name]
+        for row in rows:
+            self.formats[row] = name
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), FORMAT), self.index(max(rows), FORMAT))
+        return True
+
+    def thumbnail(self, path):
+        pixmap = self.thumbnails.get(path)
+        if pixmap is not None:
+            self.thumbnails.move_to_end(path)
+            return None if pixmap.isNull() else pixmap
+        if path not in self._requested:
+            self._requested.add(path)
+            self.thumbnailNeeded.emit(path)
+        return None
+
+    def setThumbnail(self, path, pixmap):
+        self._requested.discard(path)
+        row = self.rows.get(path)
+        if row is None:
+            return
+        self.thumbnails[path] = pixmap
+        while len(self.thumbnails) > MAX_THUMBNAILS:
+            self.thumbnails.popitem(last=False)
+        index = self.index(row, PREVIEW)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def addCards(self, paths, copies=None, merge=False, card_format=None):
+        """Appends the cards that aren't in the list yet, by path or by content. The copies of
+        duplicates are added to the existing row when merging. Returns the duplicates found."""
+        card_format = card_format or (self.formatNames[0] if self.formatNames else "")
+        copies = copies or [1]*len(paths)
+        new_paths, new_copies, duplicates = [], array('l'), []
+        pending = {}
+        for path, num_copies in zip(map(str, paths), copies):
+            existing = self.cardIndex.add(path)
+            if existing is None:
+                pending[path] = len(new_paths)
+                new_paths.append(path)
+                new_copies.append(num_copies)
+                continue
+            duplicates.append(path)
+            if not merge:
+                continue
+            if existing in pending:
+                new_copies[pending[existing]] += num_copies
+            else:
+                self.addCopies(existing, num_copies)
+        if new_paths:
+            first = len(self.paths)
+            self.beginInsertRows(QModelIndex(), first, first+len(new_paths)-1)
+            for it, path in enumerate(new_paths, first):
+                self.rows[path] = it
+            self.paths.extend(new_paths)
+            self.copies.extend(new_copies)
+            self.formats.extend([card_format]*len(new_paths))
+            self.endInsertRows()
+        return duplicates
+
+    def addCopies(self, path, num_copies):
+        row = self.rows.get(str(path))
+        if row is None:
+            return False
+        self.copies[row] += num_copies
+        index = self.index(row, COPIES)
+        self.dataChanged.emit(index, index)
+        return True
+
+    def removeCardRows(self, rows):
+        rows = set(rows)
+        if not rows:
+            return
+        # A handful of contiguous blocks are removed in place, keeping selection and scroll,
+        # anything more fragmented is rebuilt in one linear pass
+        ranges = []
+        for row in sorted(rows, reverse=True):
+            if ranges and ranges[-1][0] == row+1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+        if len(ranges) <= 8:
+            for first, last in ranges:
+                self.beginRemoveRows(QModelIndex(), first, last)
+                for path in self.paths[first:last+1]:
+                    self._forget(path)
+                del self.paths[first:last+1]
+                del self.copies[first:last+1]
+                del self.formats[first:last+1]
+                self.endRemoveRows()
+        else:
+            self.beginResetModel()
+            for row in rows:
+                self._forget(self.paths[row])
+            keep = [it for it in range(len(self.paths)) if it not in rows]
+            self.paths = [self.paths[it] for it in keep]
+            self.copies = array('l', (self.copies[it] for it in keep))
+            self.formats = [self.formats[it] for it in keep]
+            self.endResetModel()
+        self.rows = {path: it for it, path in enumerate(self.paths)}
+
+    def _forget(self, path):
+        self.cardIndex.remove(path)
+        self.thumbnails.pop(path, None)
+        self._requested.discard(path)
+
+    def clear(self):
+        self.beginResetModel()
+        self.paths = []
+        self.copies = array('l')
+        self.formats = []
+        self.rows.clear()
+        self.cardIndex.clear()
+        self.thumbnails.clear()
+        self._requested.clear()
+        self.endResetModel()
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    def paint(self, painter, option, index):
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is None:
+            return
+        rect = QRect(0, 0, pixmap.width(), pixmap.height())
+        rect.moveCenter(option.rect.center())
+        painter.drawPixmap(rect, pixmap)
+
+class FormatDelegate(QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItems(index.model().formatNames)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText())
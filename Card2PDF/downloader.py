@@ -0,0 +1,76 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+
+class RateLimiter:
+    """Spaces requests at least 1/rate seconds apart, shared by every thread."""
+    def __init__(self, rate):
+        self.interval = 1/rate if rate else 0
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next)
+            self.next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class Downloader:
+    """Concurrent downloads over a pooled keep-alive session with retries and per host rate limiting."""
+    def __init__(self, max_workers=8, rate=20, retries=3, backoff=0.3, timeout=15):
+        self.maxWorkers = max_workers
+        self.rate = rate
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=["GET", "HEAD"])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(self.rate)
+            return self.limiters[host]
+
+    def get(self, url, **kwargs):
+        self._limiter(url).wait()
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def map(self, func, iterable):
+        """Runs func over iterable with at most maxWorkers at a time, yields (item, result) as they finish."""
+        with ThreadPoolExecutor(self.maxWorkers) as pool:
+            futures = {pool.submit(func, item): item for item in iterable}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_default = None
+
+def default_downloader():
+    global _default
+    if _default is None:
+        _default = Downloader()
+    return _default
@@ -0,0 +1,73 @@
+import os, time
+
+from CardPDFWriter import Resample
+from instrument import StageSummary, env_sink, profiled
+from layout import PackedLayout
+from settings import PDF_ENGINES
+
+class ExportJob:
+    """Everything an export needs, copied from the window when it is queued so the list can keep changing."""
+    def __init__(self, file_name, settings, paper_name, profile, paths, copies, formats):
+        self.fileName = file_name
+        self.settings = dict(settings)
+        self.paperName = paper_name
+        self.profile = profile
+        self.paths = list(paths)
+        self.copies = list(copies)
+        self.formats = list(formats)
+
+    def usedFormats(self):
+        return {name for name, copies in zip(self.formats, self.copies) if copies > 0}
+
+def run_export(job, image_store=None, render_cache=None, cancelled=None, page_written=None):
+    """Writes job, returns its report: file, profile, seconds, bytes, pages, reused pages and stages.
+
+    `cancelled` is a threading.Event, once set ExportCancelled is raised and the partial PDF removed.
+    page_written(pages, total) is called after every finished page."""
+    settings = job.settings
+    start = time.perf_counter()
+    used = job.usedFormats()
+    # Without any card to draw the format only sets the empty page layout
+    card_format = settings['Card Formats'][next(iter(used)) if used else (job.formats or list(settings['Card Formats']))[0]]
+    engine = PDF_ENGINES[settings['PDF Engine']]
+    writer = engine(job.fileName, card_format, settings['Paper Formats'][job.paperName], settings['Separation'],
+                    Resample[settings['Resample']], keep_images=False, packing=settings['Packing'],
+                    cut_lines=settings['Cut Lines'], line_width=settings['Cut Line Width'],
+                    profile=settings['Export Profiles'][job.profile])
+    if cancelled is not None:
+        writer.cancelled = cancelled
+    if image_store is not None:
+        writer.loader = image_store.get
+    writer.renderCache = render_cache
+    summary = writer.recorder.add(StageSummary())
+    if page_written is not None:
+        pages = []
+        def flushed(event):
+            if event.stage == "flush":
+                pages.append(event)
+                layout = writer.layout
+                page_written(len(pages), layout.sheetCount() if isinstance(layout, PackedLayout) else layout.sheetCount(job.copies))
+        writer.recorder.add(flushed)
+    sink = env_sink(export=job.fileName, profile=job.profile)
+    if sink is not None:
+        writer.recorder.add(sink)
+    try:
+        with profiled(job.fileName):
+            cards = zip(job.paths, job.copies)
+            if len(used) > 1:
+                # Several card formats, packed together on the same sheets
+                formats = [settings['Card Formats'][name] for name in job.formats]
+                writer.addPackedCards(cards, formats, settings['Export Threads'])
+            else:
+                writer.addCards(cards, settings['Export Threads'])
+            writer.close()
+    except:
+        if writer.isOpen():
+            writer.abort()
+        raise
+    finally:
+        if sink is not None:
+            sink.close()
+    return dict(file=job.fileName, profile=job.profile, seconds=time.perf_counter() - start,
+                bytes=os.path.getsize(job.fileName), pages=writer.pageCount,
+                reused=getattr(writer, "reusedPages", 0), stages=summary.text())
@@ -0,0 +1,44 @@
+import os, threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PyQt5.QtGui import QImage
+
+class ImageStore:
+    """Least recently used decoded card images, kept under max_bytes. Safe to use from several threads."""
+    def __init__(self, max_bytes):
+        self.maxBytes = max_bytes
+        self.images = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise ValueError(f"Could not load image {path}")
+        # An edited file is a new entry, the old pixels age out of the store
+        key = (str(Path(path).resolve()), st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return self.images[key]
+        img = QImage(str(path))
+        if img.isNull():
+            raise ValueError(f"Could not load image {path}")
+        with self.lock:
+            if key not in self.images and img.sizeInBytes() <= self.maxBytes:
+                self.images[key] = img
+                self.bytes += img.sizeInBytes()
+                self._evict()
+        return img
+
+    def _evict(self):
+        while self.bytes > self.maxBytes:
+            _, img = self.images.popitem(last=False)
+            self.bytes -= img.sizeInBytes()
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.bytes = 0
@@ -0,0 +1,115 @@
+import cProfile, json, os, threading, time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# decode/scale/encode run on the worker threads, draw and flush (finished pages written out) on the caller's
+STAGES = ("decode", "scale", "encode", "draw", "flush", "download", "cache-hit", "cache-miss")
+# Saves every event of the exports as JSON lines to this file
+EVENTS_ENV = "CARD2PDF_EVENTS"
+# Any value but 0 saves a cProfile of each export next to its PDF, <pdf>.prof
+PROFILE_ENV = "CARD2PDF_PROFILE"
+
+StageEvent = namedtuple("StageEvent", "stage seconds bytes item thread")
+
+class _Span:
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+class Recorder:
+    """Sends StageEvents to its observers, any callable taking one. Events come from the
+    worker threads too, so observers have to be thread safe. Costs nothing without observers."""
+    def __init__(self, *observers):
+        self.observers = list(observers)
+
+    def add(self, observer):
+        self.observers.append(observer)
+        return observer
+
+    def remove(self, observer):
+        self.observers.remove(observer)
+
+    def emit(self, stage, seconds=0.0, nbytes=0, item=None):
+        if self.observers:
+            event = StageEvent(stage, seconds, nbytes, None if item is None else str(item),
+                               threading.current_thread().name)
+            for observer in self.observers:
+                observer(event)
+
+    @contextmanager
+    def stage(self, stage, item=None):
+        """Times the block as one event, set `bytes` of the returned span to report a size."""
+        span = _Span()
+        if not self.observers:
+            yield span
+            return
+        start = time.perf_counter()
+        yield span
+        self.emit(stage, time.perf_counter() - start, span.bytes, item)
+
+class StageSummary:
+    """Observer adding up the events, seconds and bytes of every stage."""
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            entry = self.stages.setdefault(event.stage, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += event.seconds
+            entry[2] += event.bytes
+
+    def text(self):
+        """One line, e.g. `decode 1.2 s, scale 0.8 s, draw 0.1 s, flush 0.3 s (12.5 MB), cache 40/41 hits`."""
+        with self.lock:
+            stages = dict(self.stages)
+        parts = []
+        for stage in STAGES:
+            if stage in stages and not stage.startswith("cache"):
+                count, seconds, nbytes = stages[stage]
+                parts.append(f"{stage} {seconds:.1f} s" + (f" ({nbytes/1024**2:.1f} MB)" if stage in ("flush", "download") else ""))
+        hits, misses = stages.get("cache-hit", [0])[0], stages.get("cache-miss", [0])[0]
+        if hits or misses:
+            parts.append(f"cache {hits}/{hits + misses} hits")
+        return ", ".join(parts)
+
+class JSONLinesSink:
+    """Observer appending one JSON object per event to a file, several processes can share it."""
+    def __init__(self, path, **fields):
+        # Added to every line, e.g. the PDF of the export
+        self.fields = fields
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, event):
+        record = dict(time=round(time.perf_counter() - self.start, 6), pid=os.getpid(), **self.fields, **event._asdict())
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def env_sink(**fields):
+    """The JSONLinesSink asked for by CARD2PDF_EVENTS, or None."""
+    path = os.environ.get(EVENTS_ENV)
+    return JSONLinesSink(path, **fields) if path else None
+
+@contextmanager
+def profiled(out):
+    """cProfile of the calling thread while exporting `out`, when CARD2PDF_PROFILE is set.
+    Decoding and scaling on the worker threads only shows up as time spent waiting for them."""
+    if os.environ.get(PROFILE_ENV, "0") == "0":
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{out}.prof")
@@ -0,0 +1,253 @@
+import itertools, json, os, queue, threading, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, QTimer, pyqtSignal
+
+from CardPDFWriter import ExportCancelled
+from export_worker import run_export
+from pic_cache import atomic_write
+from settings import DATA_DIR
+
+# Status of the jobs of the running app, read by `card2pdf --status`
+JOBS_FILE = DATA_DIR/"jobs.json"
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+
+# Each pool process keeps its decoded images between the jobs it runs, and shares the render cache
+# directory with the other processes, so an image is only decoded and encoded once
+_app = _store = _cache = None
+
+def _init_worker(image_bytes, render_dir, render_bytes):
+    global _app, _store, _cache
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtGui import QGuiApplication
+    from image_store import ImageStore
+    from render_cache import RenderCache
+    _app = QGuiApplication.instance() or QGuiApplication(["card2pdf-job"])
+    _store = ImageStore(image_bytes)
+    _cache = RenderCache(render_dir, render_bytes)
+
+def _run_job(job_id, job, events, cancel):
+    """Runs in a pool process, progress goes to the `events` queue and `cancel` stops it (both Manager proxies)."""
+    events.put(("started", job_id, os.getpid()))
+    cancelled, done = threading.Event(), threading.Event()
+
+    def watch():
+        while not done.is_set():
+            if cancel.wait(0.2):
+                cancelled.set()
+                return
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        return run_export(job, _store, _cache, cancelled,
+                          lambda pages, total: events.put(("page", job_id, pages, total)))
+    finally:
+        done.set()
+
+def new_job(job_id, file_name, profile, cards):
+    """Status of a job just queued, updated by the scheduler and saved as it is."""
+    return dict(id=job_id, file=file_name, profile=profile, cards=cards, state=QUEUED, pages=0, total=0,
+                submitted=time.time(), started=None, finished=None, seconds=None, bytes=None, reused=0,
+                stages="", error=None, pid=None)
+
+def job_event(job, event):
+    """Applies an event sent by _run_job to the status of its job."""
+    if event[0] == "started":
+        job.update(state=RUNNING, started=time.time(), pid=event[2])
+    else:
+        job.update(pages=event[2], total=event[3])
+
+def finish_job(job, future):
+    """Sets the final state of a job from the future of its _run_job."""
+    job["finished"] = time.time()
+    if future.cancelled():
+        job["state"] = CANCELLED
+        return
+    error = future.exception()
+    if isinstance(error, ExportCancelled):
+        job["state"] = CANCELLED
+    elif error is not None:
+        job.update(state=FAILED, error=str(error) or type(error).__name__)
+    else:
+        report = future.result()
+        job.update(state=DONE, seconds=report["seconds"], bytes=report["bytes"], pages=report["pages"],
+                   total=report["pages"], reused=report["reused"], stages=report["stages"])
+
+class JobScheduler(QObject):
+    """Runs ExportJobs on a process pool, at most `workers` of them at once, and keeps the status
+    of every job in `jobs` (id -> dict) and in JOBS_FILE."""
+    changed = pyqtSignal(int)
+    # Once a job is done, failed or cancelled
+    finished = pyqtSignal(int)
+
+    def __init__(self, workers, image_bytes, render_dir, render_bytes, status_file=JOBS_FILE, parent=None):
+        super().__init__(parent)
+        self.workers = workers
+        self.initArgs = (image_bytes, str(render_dir), render_bytes)
+        self.statusFile = Path(status_file)
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._futures = {}
+        self._cancels = {}
+        self._done = queue.Queue()
+        # Started with the first job, spawning the processes takes a while
+        self.pool = self.manager = self.events = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(100)
+        self.timer.timeout.connect(self._poll)
+        self._saved = 0
+
+    def _start(self):
+        context = get_context("spawn")
+        self.manager = context.Manager()
+        self.events = self.manager.Queue()
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker, initargs=self.initArgs)
+
+    def submit(self, job):
+        if self.pool is None:
+            self._start()
+        job_id = next(self._ids)
+        self.jobs[job_id] = new_job(job_id, job.fileName, job.profile, sum(job.copies))
+        self._cancels[job_id] = cancel = self.manager.Event()
+        future = self.pool.submit(_run_job, job_id, job, self.events, cancel)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _, job_id=job_id: self._done.put(job_id))
+        self.timer.start()
+        self.changed.emit(job_id)
+        self.save()
+        return job_id
+
+    def cancel(self, job_id):
+        if self.jobs.get(job_id, {}).get("state") not in ACTIVE:
+            return
+        # A job still waiting for a process is just dropped, a running one stops at its next card
+        if not self._futures[job_id].cancel():
+            self._cancels[job_id].set()
+
+    def active(self):
+        return [job for job in self.jobs.values() if job["state"] in ACTIVE]
+
+    def clearFinished(self):
+        for job_id in [job["id"] for job in self.jobs.values() if job["state"] not in ACTIVE]:
+            del self.jobs[job_id]
+        self.save()
+
+    def _poll(self):
+        changed = set()
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs.get(event[1])
+            if job is None or job["state"] not in ACTIVE:
+                continue
+            job_event(job, event)
+            changed.add(job["id"])
+        finished = []
+        while not self._done.empty():
+            job_id = self._done.get()
+            finish_job(self.jobs[job_id], self._futures.pop(job_id))
+            self._cancels.pop(job_id)
+            changed.add(job_id)
+            finished.append(job_id)
+        for job_id in sorted(changed):
+            self.changed.emit(job_id)
+        for job_id in finished:
+            self.finished.emit(job_id)
+        if not self._futures:
+            self.timer.stop()
+        # Page progress is saved at most twice a second
+        if finished or (changed and time.time() - self._saved > 0.5):
+            self.save()
+
+    def save(self):
+        self._saved = time.time()
+        data = dict(pid=os.getpid(), updated=self._saved, jobs=list(self.jobs.values()))
+        atomic_write(self.statusFile, json.dumps(data, indent=1).encode())
+
+    def shutdown(self):
+        """Cancels every job and waits for the running ones to remove their partial PDFs."""
+        if self.pool is None:
+            return
+        for job_id in list(self._futures):
+            self.cancel(job_id)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self._poll()
+        self.manager.shutdown()
+        self.pool = None
+
+def job_progress(job):
+    if job["state"] == RUNNING and job["total"]:
+        return f"{job['pages']}/{job['total']} pages"
+    if job["state"] == DONE:
+        return f"{job['pages']} pages, {job['seconds']:.1f} s, {job['bytes']/1024**2:.1f} MB"
+    if job["state"] == FAILED:
+        return job["error"]
+    return ""
+
+def read_jobs(path=JOBS_FILE):
+    """Status saved by the app, jobs of an app that is no longer running are marked stale."""
+    try:
+        data = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return []
+    try:
+        os.kill(data["pid"], 0)
+        alive = True
+    except PermissionError:
+        alive = True
+    except (OSError, KeyError):
+        alive = False
+    jobs = data.get("jobs", [])
+    if not alive:
+        for job in jobs:
+            if job["state"] in ACTIVE:
+                job["state"] = "stale"
+    return jobs
+
+class JobTableModel(QAbstractTableModel):
+    HEADERS = ["#", "PDF", "Profile", "Cards", "State", "Progress"]
+
+    def __init__(self, scheduler, parent=None):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.ids = []
+        scheduler.changed.connect(self.jobChanged)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        job = self.scheduler.jobs.get(self.ids[index.row()])
+        if job is None:
+            return None
+        if role == Qt.ToolTipRole:
+            return job["stages"] or job["file"]
+        return [job["id"], Path(job["file"]).name, job["profile"], job["cards"], job["state"], job_progress(job)][index.column()]
+
+    def jobChanged(self, job_id):
+        if job_id not in self.ids:
+            self.beginInsertRows(QModelIndex(), len(self.ids), len(self.ids))
+            self.ids.append(job_id)
+            self.endInsertRows()
+            return
+        row = self.ids.index(job_id)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+
+    def reset(self):
+        self.beginResetModel()
+        self.ids = [job_id for job_id in self.ids if job_id in self.scheduler.jobs]
+        self.endResetModel()
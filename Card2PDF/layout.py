@@ -0,0 +1,326 @@
+from collections import namedtuple
+from functools import lru_cache
+
+# Positions are in pixels at the layout resolution, (0, 0) is the top left corner of the sheet
+Slot = namedtuple("Slot", "x y width height rotation")
+Placement = namedtuple("Placement", "page x y width height rotation card")
+Line = namedtuple("Line", "x1 y1 x2 y2")
+
+# "Upright" is the plain grid, "Mixed" also tries rows or columns of cards turned 90 degrees
+PACKINGS = ("Upright", "Mixed")
+# Whole cut lines, only their ends on the sheet margins (crop marks) or nothing
+CUT_LINES = ("Full", "Corners", "None")
+
+def mm2pix(args, resolution):
+    return [x*(resolution/25.4) for x in args]
+
+def crop_marks(lines, slots, separation):
+    """What is left of the cut lines outside the area covered by the cards."""
+    if not slots:
+        return ()
+    # The lines around the outer cards are half a separation away from them
+    left = min(s.x for s in slots) - separation[0]
+    right = max(s.x + s.width for s in slots) + separation[0]
+    top = min(s.y for s in slots) - separation[1]
+    bottom = max(s.y + s.height for s in slots) + separation[1]
+    marks = []
+    for line in lines:
+        if line.x1 == line.x2 and left < line.x1 < right:
+            lo, hi = sorted((line.y1, line.y2))
+            marks += [Line(line.x1, lo, line.x1, top)]*(lo < top) + [Line(line.x1, bottom, line.x1, hi)]*(hi > bottom)
+        elif line.y1 == line.y2 and top < line.y1 < bottom:
+            lo, hi = sorted((line.x1, line.x2))
+            marks += [Line(lo, line.y1, left, line.y1)]*(lo < left) + [Line(right, line.y1, hi, line.y1)]*(hi > right)
+        else:
+            marks.append(line)
+    return tuple(marks)
+
+class SheetLayout:
+    """Where cards go on a sheet. Pure python, computed once per formats and reused."""
+    def __init__(self, card_format, paper_format, separation=(0.8, 0.8), resolution=300, packing="Upright"):
+        if packing not in PACKINGS:
+            raise ValueError(f"Unknown packing {packing}")
+        self.cardFormat = mm2pix(card_format, resolution)
+        self.paperFormat = mm2pix(paper_format, resolution)
+        self.separation = mm2pix(separation, resolution)
+        self.resolution = resolution
+        self.packing = packing
+
+        card, paper, sep = self.cardFormat, self.paperFormat, self.separation
+        self.bleeding = [(paper[it] % int(card[it] + sep[it]))/2 for it in range(2)]
+        # The first row and column are always used, even if the card doesn't fit the sheet
+        xs = self._positions(self.bleeding[0], card[0] + sep[0], paper[0] - self.bleeding[0] - card[0])
+        ys = self._positions(self.bleeding[1], card[1] + sep[1], paper[1] - self.bleeding[1] - card[1])
+        self.slots = tuple(Slot(x, y, *card, 0) for y in ys for x in xs)
+        self.cutLines = tuple(self._cutLines())
+        self._marks = None
+        if packing == "Mixed":
+            self._pickMixed()
+
+    @staticmethod
+    def _positions(start, step, limit):
+        # Repeated addition, not multiplication, so positions match the cursor the writers used to move
+        pos = [start]
+        while pos[-1] + step <= limit:
+            pos.append(pos[-1] + step)
+        return pos
+
+    def _cutLines(self):
+        card, paper, sep = self.cardFormat, self.paperFormat, self.separation
+        pos = self.bleeding[0] - sep[0]/2
+        while (pos < paper[0]):
+            yield Line(pos, 0, pos, paper[1])
+            pos += card[0] + sep[0]
+        pos = self.bleeding[1] - sep[1]/2
+        while (pos < paper[1]):
+            yield Line(0, pos, paper[0], pos)
+            pos += card[1] + sep[1]
+
+    def _pickMixed(self):
+        # Upright cards followed by rotated ones, stacked as rows (axis 1) or columns (axis 0).
+        # Ties keep the plain grid, then the layout with fewer rotated cards
+        best = len(self.slots)
+        for axis in (1, 0):
+            for upright in range(self._fits(axis, 0), -1, -1):
+                slots, lines = self._stacked(axis, upright)
+                if len(slots) > best:
+                    best = len(slots)
+                    self.slots, self.cutLines = tuple(slots), tuple(lines)
+
+    def _size(self, rotation):
+        return self.cardFormat if rotation == 0 else self.cardFormat[::-1]
+
+    def _fits(self, axis, rotation, length=None):
+        # Cards side by side with the separation between them
+        size, sep = self._size(rotation)[axis], self.separation[axis]
+        length = self.paperFormat[axis] if length is None else length
+        return max(0, int((length + sep)//(size + sep)))
+
+    def _stacked(self, axis, upright):
+        paper, sep = self.paperFormat, self.separation
+        other = 1 - axis
+        pitch = [self._size(rot)[axis] + sep[axis] for rot in (0, 90)]
+        rotated = self._fits(axis, 90, paper[axis] - upright*pitch[0])
+        bands = [0]*upright + [90]*rotated
+        if not bands:
+            return [], []
+
+        def point(along, across):
+            return (across, along) if axis == 1 else (along, across)
+
+        def line(along, lo, hi, across=False):
+            # across=True: a line at `along` that runs over the whole sheet, otherwise a
+            # line at the `along` coordinate of the other axis running from lo to hi
+            if across:
+                return Line(*point(along, 0), *point(along, paper[other]))
+            return Line(*point(lo, along), *point(hi, along))
+
+        slots, lines = [], []
+        pos = (paper[axis] - sum(pitch[rot == 90] for rot in bands) + sep[axis])/2
+        block_start = 0
+        for it, rot in enumerate(bands):
+            size = self._size(rot)
+            count = self._fits(other, rot)
+            start = (paper[other] - count*(size[other] + sep[other]) + sep[other])/2
+            for k in range(count):
+                slots.append(Slot(*point(pos, start + k*(size[other] + sep[other])), *size, rot))
+            lines.append(line(pos - sep[axis]/2, 0, 0, across=True))
+            pos += size[axis] + sep[axis]
+            # Cuts between the cards run over the whole block of bands with the same rotation
+            if it == len(bands)-1 or bands[it+1] != rot:
+                block_end = paper[axis] if it == len(bands)-1 else pos - sep[axis]/2
+                for k in range(count+1):
+                    lines.append(line(start - sep[other]/2 + k*(size[other] + sep[other]), block_start, block_end))
+                block_start = block_end
+        lines.append(line(pos - sep[axis]/2, 0, 0, across=True))
+        return slots, lines
+
+    @property
+    def slotsPerSheet(self):
+        return len(self.slots)
+
+    def slotAt(self, it):
+        """Page and slot of the it-th card drawn."""
+        page, slot = divmod(it, len(self.slots))
+        return page, self.slots[slot]
+
+    def pageCutLines(self, page, style="Full"):
+        if style == "None":
+            return ()
+        if style == "Corners":
+            if self._marks is None:
+                self._marks = crop_marks(self.cutLines, self.slots, self.separation)
+            return self._marks
+        return self.cutLines
+
+    def sheetCount(self, copies):
+        total = sum(copies)
+        return max(1, -(-total//self.slotsPerSheet))
+
+    def plan(self, copies):
+        """Placement of every copy, `copies` being the number of copies of each card in order."""
+        placements = []
+        per_sheet = len(self.slots)
+        it = 0
+        for card, num_copies in enumerate(copies):
+            for _ in range(num_copies):
+                slot = self.slots[it % per_sheet]
+                placements.append(Placement(it//per_sheet, *slot, card))
+                it += 1
+        return placements
+
+@lru_cache(maxsize=64)
+def _cached_layout(card_format, paper_format, separation, resolution, packing):
+    return SheetLayout(card_format, paper_format, separation, resolution, packing)
+
+def get_layout(card_format, paper_format, separation=(0.8, 0.8), resolution=300, packing="Upright"):
+    return _cached_layout(tuple(card_format), tuple(paper_format), tuple(separation), resolution, packing)
+
+
+class PackedLayout:
+    """Cards of different formats packed on as few sheets as possible.
+
+    Guillotine shelf packing: each sheet is cut in full width shelves (or full height ones,
+    whichever takes fewer sheets) and each shelf in cards, so everything can still be cut
+    with straight cuts. Bigger cards are placed first and cards are turned whenever that
+    fits more of them."""
+    def __init__(self, formats, copies, paper_format, separation=(0.8, 0.8), resolution=300):
+        self.paperFormat = mm2pix(paper_format, resolution)
+        self.separation = mm2pix(separation, resolution)
+        self.resolution = resolution
+        sizes = [tuple(mm2pix(card_format, resolution)) for card_format in formats]
+        W, H = self.paperFormat
+        for (w, h), card_format, num_copies in zip(sizes, formats, copies):
+            if num_copies > 0 and not (w <= W and h <= H or h <= W and w <= H):
+                raise ValueError(f"A {card_format[0]:g}x{card_format[1]:g} mm card doesn't fit on "
+                                 f"{paper_format[0]:g}x{paper_format[1]:g} mm paper")
+        # Cards are drawn in this order, copies of a card and cards of the same format stay together
+        self.order = sorted((it for it in range(len(copies)) if copies[it] > 0),
+                            key=lambda it: (-max(sizes[it]), -min(sizes[it]), it))
+        # Shelves of every sheet, [top, height, used width, [(order, card, x, width, height, rotation)]]
+        self._sheets = None
+        for columns in (False, True):
+            sheets = self._pack(sizes, copies, columns)
+            if self._sheets is None or len(sheets) < len(self._sheets):
+                self._sheets, self.columns = sheets, columns
+        self.placements = []
+        self.cutLines = []
+        self._marks = {}
+        for page, shelves in enumerate(self._sheets):
+            self._finishSheet(page, shelves)
+        # In the order the cards were placed, the order they have to be drawn in
+        self.placements = [p for _, p in sorted(self.placements)]
+
+    def _pack(self, sizes, copies, columns):
+        # Column shelves are packed as rows on the sheet turned on its side
+        flip = (lambda v: v[::-1]) if columns else tuple
+        self._paper, self._sep = flip(self.paperFormat), flip(self.separation)
+        self._rows = {}
+        self._count = 0
+        sheets = []
+        for card in self.order:
+            w, h = flip(sizes[card])
+            for _ in range(copies[card]):
+                self._place(sheets, card, w, h)
+        return sheets
+
+    @staticmethod
+    def _orientations(w, h):
+        return ((w, h, 0),) if w == h else ((w, h, 0), (h, w, 90))
+
+    def _fitsAcross(self, cw):
+        W, sx = self._paper[0], self._sep[0]
+        return int((W + sx)//(cw + sx))
+
+    def _bestRows(self, w, h, free):
+        """Most (w, h) cards that fit in `free` height of shelves and the rotation of the first shelf."""
+        key = (w, h, round(free, 3))
+        if key not in self._rows:
+            sy = self._sep[1]
+            best = (0, None)
+            for cw, ch, rot in self._orientations(w, h):
+                across = self._fitsAcross(cw)
+                if ch + sy <= free and across > 0:
+                    count = across + self._bestRows(w, h, free - ch - sy)[0]
+                    if count > best[0]:
+                        best = (count, rot)
+            self._rows[key] = best
+        return self._rows[key]
+
+    def _place(self, sheets, card, w, h):
+        W, (sx, sy) = self._paper[0], self._sep
+        shelves = sheets[-1] if sheets else None
+        if shelves is not None:
+            # First shelf of the sheet with room, turned if that fills the shelf height better
+            for shelf in shelves:
+                for cw, ch, rot in sorted(self._orientations(w, h), key=lambda o: -o[1]):
+                    if ch <= shelf[1] and shelf[2] + sx + cw <= W:
+                        shelf[3].append((self._count, card, shelf[2] + sx, cw, ch, rot))
+                        self._count += 1
+                        shelf[2] += sx + cw
+                        return
+            free = self._paper[1] + sy - sum(shelf[1] + sy for shelf in shelves)
+            rot = self._bestRows(w, h, free)[1]
+        if shelves is None or rot is None:
+            shelves = []
+            sheets.append(shelves)
+            rot = self._bestRows(w, h, self._paper[1] + sy)[1]
+        cw, ch = (w, h) if rot == 0 else (h, w)
+        top = sum(shelf[1] + sy for shelf in shelves)
+        shelves.append([top, ch, cw, [(self._count, card, 0, cw, ch, rot)]])
+        self._count += 1
+
+    def _finishSheet(self, page, shelves):
+        # Same coordinates the sheet was packed in, swapped back at the end for column shelves
+        flip = (lambda v: v[::-1]) if self.columns else tuple
+        (W, H), (sx, sy) = flip(self.paperFormat), flip(self.separation)
+        top = (H - sum(shelf[1] + sy for shelf in shelves) + sy)/2
+        lines, seen = [], set()
+
+        def add(x1, y1, x2, y2):
+            line = Line(y1, x1, y2, x2) if self.columns else Line(x1, y1, x2, y2)
+            key = tuple(round(v, 3) for v in line)
+            if key not in seen:
+                seen.add(key)
+                lines.append(line)
+
+        for it, (y, height, used, cards) in enumerate(shelves):
+            y += top
+            left = (W - used)/2
+            lo = 0 if it == 0 else y - sy/2
+            hi = H if it == len(shelves)-1 else y + height + sy/2
+            add(0, y - sy/2, W, y - sy/2)
+            add(0, y + height + sy/2, W, y + height + sy/2)
+            for order, card, x, cw, ch, rot in cards:
+                x += left
+                if self.columns:
+                    self.placements.append((order, Placement(page, y, x, ch, cw, rot, card)))
+                else:
+                    self.placements.append((order, Placement(page, x, y, cw, ch, rot, card)))
+                add(x - sx/2, lo, x - sx/2, hi)
+                add(x + cw + sx/2, lo, x + cw + sx/2, hi)
+                if ch < height:
+                    add(x - sx/2, y + ch + sy/2, x + cw + sx/2, y + ch + sy/2)
+        self.cutLines.append(tuple(lines))
+
+    def sheetCount(self):
+        return max(1, len(self._sheets))
+
+    def utilization(self):
+        """Fraction of the paper covered by cards."""
+        area = sum(p.width*p.height for p in self.placements)
+        return area/(self.sheetCount()*self.paperFormat[0]*self.paperFormat[1])
+
+    def slotAt(self, it):
+        p = self.placements[it]
+        return p.page, Slot(p.x, p.y, p.width, p.height, p.rotation)
+
+    def pageCutLines(self, page, style="Full"):
+        if style == "None" or page >= len(self.cutLines):
+            return ()
+        if style == "Corners":
+            if page not in self._marks:
+                slots = [self.slotAt(it)[1] for it, p in enumerate(self.placements) if p.page == page]
+                self._marks[page] = crop_marks(self.cutLines[page], slots, self.separation)
+            return self._marks[page]
+        return self.cutLines[page]
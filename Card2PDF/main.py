@@ -1,12 +1,18 @@
-import json, os, sys
+import multiprocessing, sys
 from pathlib import Path
 
-from PyQt5.QtCore import Qt, QDir, QRect
-from PyQt5.QtWidgets import QApplication, QFileDialog, QDialog,QMainWindow, QTableWidget,QTableWidgetItem, QHeaderView, QPushButton, QLabel
-from PyQt5.QtGui import QIcon, QPixmap
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtWidgets import (QApplication, QFileDialog, QDialog,QMainWindow, QHeaderView, QPushButton, QLabel,
+                             QDockWidget, QTableView, QWidget, QHBoxLayout, QVBoxLayout)
+from PyQt5.QtGui import QPixmap, QImageReader
 
 from Ui_MainWindow import Ui_MainWindow
-from CardPDFWriter import CardPDFWriter
+from card_model import CardTableModel, FormatDelegate, ThumbnailDelegate, COPIES, FORMAT, PREVIEW
+from export_worker import ExportJob
+from jobs import CANCELLED, FAILED, JobScheduler, JobTableModel
+from layout import PackedLayout, get_layout
+from thumbnails import ThumbnailLoader
+from settings import RENDER_DIR, THUMB_DIR, load_settings, flush_settings
 from ygo_parser import YGOProParser
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -29,151 +35,217 @@ class DialogMesage(QDialog):
         self.okButton.clicked.connect(self.close)
         self.okButton.setText("Ok")
 
-class ImgItemWidget(QLabel):
-    def __init__(self, img:QPixmap, parent=None):
-        super().__init__(parent)
-        self.img = img.scaled(50, 70)
-        self.setPixmap(self.img)
-
-def check_formats_ok(formats):
-    try:
-        if isinstance(formats, (tuple, list)):
-            assert len(formats) == 2
-            for x in formats:
-                assert isinstance(x, (int, float))
-            return True
-        elif isinstance(formats, dict):
-            for val in formats.values():
-                assert check_formats_ok(val)
-        else:
-            return False
-    except AssertionError:
-        return False
-    return True
-
 class Card2PDFGUI(QMainWindow, Ui_MainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setupUi(self)
-        # Config File
-        try:
-            with (BASE_DIR/"Settings.json").open('r') as f:
-                _config = json.load(f)
-        except:
-            _config = {}
-        # Defaults
-        self.settings = {}
-        self.settings["Paper Formats"] = {"Ledger 432x279 mm": [432, 279]}
-        self.settings["Card Formats"] = dict(Pokemon=[63, 88], Yugioh=[59, 85.5])
-        self.settings["Separation"] = [0.8, 0.8]
-        self.settings["YGOPro Deck Folder"] = str(BASE_DIR.parent)
-        # Read and check config
-        if "Paper Formats" in _config and check_formats_ok(_config["Paper Formats"]):
-            self.settings["Paper Formats"] = _config["Paper Formats"]
-        if "Card Formats" in _config and check_formats_ok(_config["Card Formats"]):
-            self.settings["Card Formats"] = _config["Card Formats"]
-        if "Separation" in _config and check_formats_ok(_config["Separation"]):
-            self.settings["Separation"] = _config["Separation"]
-        if "YGOPro Deck Folder" in _config and Path(str(_config["YGOPro Deck Folder"])).resolve().exists():
-            self.settings["YGOPro Deck Folder"] = _config["YGOPro Deck Folder"]
+        self.settings = load_settings()
         
-        self.imageNames = []
-        self.images = []
+        # Only the paths and small thumbnails stay in the table, full images are decoded by the
+        # export processes, each one keeps at most "Image Memory MB" of them between its jobs
+        self.cardModel = CardTableModel(self)
+        self.scheduler = JobScheduler(self.settings["Parallel Exports"], int(self.settings["Image Memory MB"]*1024**2),
+                                      RENDER_DIR, int(self.settings["Render Cache MB"]*1024**2), parent=self)
+        self.scheduler.finished.connect(self.jobFinished)
         self.setWindowTitle("Card2PDF") 
         
         for key in self.settings['Card Formats']:
             self.cardComboBox.addItem(key)
+        self.cardModel.formatNames = list(self.settings['Card Formats'])
         
         for key in self.settings['Paper Formats']:
             self.paperComboBox.addItem(key)
+
+        for key in self.settings['Export Profiles']:
+            self.profileComboBox.addItem(key)
+        self.profileComboBox.setCurrentText(self.settings['Export Profile'])
+        # Exports, seconds and bytes written by every profile since the window was opened
+        self.profileStats = {}
             
-        self.tableWidget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.tableWidget.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
-        self.tableWidget.verticalHeader().setDefaultSectionSize(70)
+        self.tableView.setModel(self.cardModel)
+        self.tableView.setItemDelegateForColumn(PREVIEW, ThumbnailDelegate(self.tableView))
+        self.tableView.setItemDelegateForColumn(FORMAT, FormatDelegate(self.tableView))
+        self.tableView.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.verticalHeader().setDefaultSectionSize(70)
         
         self.addCardsButton.clicked.connect(self.selectImages)
         self.exportButton.clicked.connect(self.makePDF)
         self.clearButton.clicked.connect(self.clearList)
         self.removeCardsButton.clicked.connect(self.removeSelected)
         self.ygopro = YGOProParser(self)
+        self.thumbnailLoader = ThumbnailLoader(THUMB_DIR, self)
+        self.thumbnailLoader.ready.connect(self.setThumbnail)
+        self.cardModel.thumbnailNeeded.connect(self.thumbnailLoader.request)
+
+        self.sheetLabel = QLabel(self)
+        self.statusbar.addPermanentWidget(self.sheetLabel)
+        self.setupJobsPanel()
+        for signal in (self.cardModel.rowsInserted, self.cardModel.rowsRemoved, self.cardModel.modelReset):
+            signal.connect(self.updateSheetCount)
+        self.cardModel.dataChanged.connect(self.cardsChanged)
+        self.cardComboBox.activated.connect(self.applyCardFormat)
+        self.paperComboBox.currentIndexChanged.connect(self.updateSheetCount)
+        self.updateSheetCount()
     
     def selectImages(self):
         new_images, ok = QFileDialog.getOpenFileNames(self, "Choose one or more Card Images",
             str(BASE_DIR),"Images (*.png *.xpm *.jpg);;All Files (*)")
         if not ok or not new_images:
             return
-        new_images = list(filter(lambda img: img not in self.imageNames, new_images))
         self.addImgsToTable(new_images)
 
-    def addImgsToTable(self, new_images):
-        old_len = len(self.imageNames)
-        for img in new_images:
-            pixmap = QPixmap(img)
-            if pixmap.isNull():
-                continue
-            self.imageNames.append(img)
-            self.images.append(pixmap)
-        new_len = len(self.imageNames)
-
-        for it in range(old_len, new_len):
-            self.tableWidget.insertRow(it)
-            base_file_name = Path(self.imageNames[it]).name
-            self.tableWidget.setItem(it, 0, QTableWidgetItem(base_file_name))
-            self.tableWidget.item(it, 0).setFlags(Qt.ItemIsSelectable|Qt.ItemIsEnabled)
-            self.tableWidget.setItem(it, 1, QTableWidgetItem('1'))
-            self.tableWidget.setCellWidget(it, 2, ImgItemWidget(self.images[it], self.tableWidget))
-        if (new_len-old_len) != len(new_images):
+    def addImgsToTable(self, new_images, copies=None, merge=False, card_format=None):
+        copies = copies or [1]*len(new_images)
+        card_format = card_format or self.cardComboBox.currentText()
+        # Only checks the header, the thumbnail is decoded in the background when the row is shown
+        added = [(img, num) for img, num in zip(new_images, copies) if QImageReader(img).canRead()]
+        # Same file or same content as a card in the list
+        duplicates = self.cardModel.addCards([img for img, _ in added], [num for _, num in added], merge, card_format)
+        if duplicates and not merge:
+            self.statusbar.showMessage(f"{len(duplicates)} cards were already in the list")
+        if len(added) != len(new_images):
             DialogMesage(self, "ERROR", "Some images could not be loaded").show()
-    
+        return len(added) - len(duplicates)
+
+    def setThumbnail(self, path, img):
+        self.cardModel.setThumbnail(path, QPixmap.fromImage(img))
+
+    def applyCardFormat(self, *args):
+        # Sets the format of the selected cards, or of every card when none is selected
+        rows = {index.row() for index in self.tableView.selectionModel().selectedIndexes()}
+        self.cardModel.setFormat(rows or range(self.cardModel.rowCount()), self.cardComboBox.currentText())
+
+    def usedFormats(self):
+        return {name for name, copies in zip(self.cardModel.formats, self.cardModel.copies) if copies > 0}
+
+    def cardsChanged(self, top_left, bottom_right, roles=None):
+        # Thumbnails arriving don't change the layout, planning mixed formats again takes a while
+        if top_left.column() <= FORMAT and bottom_right.column() >= COPIES and roles != [Qt.DecorationRole]:
+            self.updateSheetCount()
+
+    def updateSheetCount(self, *args):
+        paper_format = self.settings['Paper Formats'].get(self.paperComboBox.currentText())
+        if paper_format is None:
+            self.sheetLabel.clear()
+            return
+        used = self.usedFormats()
+        if len(used) > 1:
+            formats = [self.settings['Card Formats'][name] for name in self.cardModel.formats]
+            try:
+                layout = PackedLayout(formats, self.cardModel.copies, paper_format, self.settings['Separation'])
+            except ValueError as e:
+                self.sheetLabel.setText(str(e))
+                return
+            self.sheetLabel.setText(f"{layout.sheetCount()} sheets (mixed formats)")
+            return
+        # Layouts are cached, this is just a sum over the copies
+        card_format = self.settings['Card Formats'][next(iter(used)) if used else self.cardComboBox.currentText()]
+        layout = get_layout(card_format, paper_format, self.settings['Separation'], packing=self.settings['Packing'])
+        sheets = layout.sheetCount(self.cardModel.copies) if used else 0
+        self.sheetLabel.setText(f"{sheets} sheets ({layout.slotsPerSheet} cards per sheet)")
+
     def clearList(self):
-        self.images.clear()
-        self.imageNames.clear()
-        self.tableWidget.setRowCount(0)
+        self.cardModel.clear()
     
+    def setupJobsPanel(self):
+        self.jobModel = JobTableModel(self.scheduler, self)
+        self.jobView = QTableView()
+        self.jobView.setModel(self.jobModel)
+        self.jobView.setSelectionBehavior(QTableView.SelectRows)
+        self.jobView.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.jobView.horizontalHeader().setStretchLastSection(True)
+        self.jobView.verticalHeader().hide()
+        self.cancelJobButton = QPushButton("Cancel")
+        self.cancelJobButton.clicked.connect(self.cancelJobs)
+        self.clearJobsButton = QPushButton("Clear Finished")
+        self.clearJobsButton.clicked.connect(self.clearJobs)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.cancelJobButton)
+        buttons.addWidget(self.clearJobsButton)
+        buttons.addStretch()
+        panel = QWidget()
+        layout = QVBoxLayout(panel)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.jobView)
+        layout.addLayout(buttons)
+        self.jobsDock = QDockWidget("Export Jobs", self)
+        self.jobsDock.setObjectName("jobsDock")
+        self.jobsDock.setWidget(panel)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.jobsDock)
+        self.jobsDock.hide()
+
     def makePDF(self):
-        if not self.images:
+        if not self.cardModel.rowCount():
             DialogMesage(self, "ERROR", "The Card list is empty").show()
             return
         file_name, ok = QFileDialog.getSaveFileName(self, "Save PDF Document", str(BASE_DIR/"out.pdf"),
                         "PDF (*.pdf);;All Files (*)")
         if not ok:
             return
-        paper_format = self.settings['Paper Formats'][self.paperComboBox.currentText()]
-        card_format = self.settings['Card Formats'][self.cardComboBox.currentText()]
-        copies = self.parseNumCopies()
-        if not copies:
-            DialogMesage(self, "ERROR", "Incorrect value in number of copies").show()
+        if any(job["file"] == file_name for job in self.scheduler.active()):
+            DialogMesage(self, "ERROR", "That PDF is already being exported").show()
             return
-        PDFWriter = CardPDFWriter(file_name, card_format, paper_format, self.settings['Separation'])
-        for img, num_copies in zip(self.images, copies):
-            PDFWriter.addCard(img, num_copies)
-        PDFWriter.close()
-        DialogMesage(self, "Success!!", "PDF Exported Correctly").show()
+        # The list can keep changing while the job waits or runs
+        job_id = self.scheduler.submit(ExportJob(file_name, self.settings, self.paperComboBox.currentText(),
+                                                 self.profileComboBox.currentText(), self.cardModel.paths,
+                                                 self.parseNumCopies(), self.cardModel.formats))
+        self.jobsDock.show()
+        self.statusbar.showMessage(f"Export job #{job_id} queued")
+
+    def cancelJobs(self):
+        # The selected jobs, or every unfinished one when none is selected
+        rows = {index.row() for index in self.jobView.selectionModel().selectedRows()}
+        ids = [self.jobModel.ids[row] for row in rows] or [job["id"] for job in self.scheduler.active()]
+        for job_id in ids:
+            self.scheduler.cancel(job_id)
+
+    def clearJobs(self):
+        self.scheduler.clearFinished()
+        self.jobModel.reset()
+
+    def jobFinished(self, job_id):
+        job = self.scheduler.jobs[job_id]
+        name = Path(job["file"]).name
+        if job["state"] == CANCELLED:
+            self.statusbar.showMessage(f"Export of {name} cancelled")
+            return
+        if job["state"] == FAILED:
+            DialogMesage(self, "ERROR", f"Export of {name} failed: {job['error']}").show()
+            return
+        stats = self.profileStats.setdefault(job["profile"], dict(exports=0, seconds=0, bytes=0))
+        stats["exports"] += 1
+        stats["seconds"] += job["seconds"]
+        stats["bytes"] += job["bytes"]
+        message = [f"{name} ({job['profile']}): {job['seconds']:.1f} s, {job['bytes']/1024**2:.1f} MB"]
+        if stats["exports"] > 1:
+            message[0] += (f" ({stats['exports']} exports, {stats['seconds']:.1f} s, "
+                           f"{stats['bytes']/1024**2:.1f} MB so far)")
+        if job["reused"]:
+            message.append(f"{job['reused']} of {job['pages']} pages unchanged")
+        message.append(job["stages"])
+        self.statusbar.showMessage(", ".join(message))
+        DialogMesage(self, "Success!!", f"{name} Exported Correctly").show()
+
+    def closeEvent(self, event):
+        # Running jobs remove their unfinished PDFs, queued ones are dropped
+        self.scheduler.shutdown()
+        super().closeEvent(event)
     
     def parseNumCopies(self):
-        result = []
-        for it in range(self.tableWidget.rowCount()):
-            try:
-                num_copies = int(self.tableWidget.item(it, 1).text())
-                assert num_copies >= 0
-            except:
-                return []
-            result.append(num_copies)
-        return result
+        # The model only accepts non negative integers
+        return list(self.cardModel.copies)
     
     def removeSelected(self):
-        items = sorted(map(self.tableWidget.row, self.tableWidget.selectedItems()), reverse=True)
-        for it in items:
-            self.tableWidget.removeRow(it)
-            self.imageNames.pop(it)
-            self.images.pop(it)
+        rows = {index.row() for index in self.tableView.selectionModel().selectedIndexes()}
+        self.cardModel.removeCardRows(rows)
     
     def flushSettings(self):
-        with (BASE_DIR/"Settings.json").open('w') as f:
-            json.dump(self.settings, f, indent=2)
-            f.flush()
+        flush_settings(self.settings)
 
 if __name__ == "__main__":
+    # The export processes are spawned from the frozen exe too
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     
     GUI = Card2PDFGUI()
@@ -0,0 +1,243 @@
+import argparse, hashlib, json, os, tempfile, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError: # Windows
+    import msvcrt
+    fcntl = None
+
+INDEX_NAME = "index.json"
+LOCK_NAME = "index.lock"
+DEFAULT_MAX_BYTES = 2*1024**3
+# Only readable by their owner when mkstemp makes them, files get the mode open() would have given
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def jpeg_complete(data):
+    # Truncated downloads lose the End Of Image marker, some encoders pad after it
+    return data[:2] == b"\xff\xd8" and data.rstrip(b"\0\r\n ").endswith(b"\xff\xd9")
+
+def atomic_write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o666 & ~UMASK)
+        os.replace(tmp, path)
+    except:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on `path` (created if needed) between processes, blocks until it is free."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # Retries for 10 s, then raises OSError
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class PicCache:
+    """Card pictures stored as <id>.jpg plus an index of id -> sha256, size, fetch time, ETag
+    and last use, kept under max_bytes by evicting the least recently used pictures.
+    put() only updates the index in memory, save() writes it once a batch of downloads is done."""
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.maxBytes = max_bytes
+        self.lock = threading.RLock()
+        self.index = {}
+        try:
+            with (self.dir/INDEX_NAME).open("r") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.bytes = sum(entry["size"] for entry in self.index.values())
+
+    def path(self, card_id):
+        return self.dir/f"{card_id}.jpg"
+
+    def totalBytes(self):
+        with self.lock:
+            return self.bytes
+
+    def save(self):
+        # Other processes (card2pdf workers, the GUI, the server) save the same index: their entries are
+        # kept unless the picture is gone, the most recently fetched copy of an entry wins
+        with self.lock, file_lock(self.dir/LOCK_NAME):
+            try:
+                with (self.dir/INDEX_NAME).open("r") as f:
+                    disk = json.load(f)
+            except (OSError, ValueError):
+                disk = {}
+            for card_id, entry in disk.items():
+                ours = self.index.get(card_id)
+                if ours is None:
+                    if self.path(card_id).exists():
+                        self.index[card_id] = entry
+                        self.bytes += entry["size"]
+                elif entry["fetched"] > ours["fetched"]:
+                    self.bytes += entry["size"] - ours["size"]
+                    self.index[card_id] = dict(entry, used=max(entry["used"], ours["used"]))
+                else:
+                    ours["used"] = max(entry["used"], ours["used"])
+            atomic_write(self.dir/INDEX_NAME, json.dumps(self.index, separators=(",", ":")).encode())
+
+    def get(self, card_id):
+        card_id = str(card_id)
+        path = self.path(card_id)
+        with self.lock:
+            entry = self.index.get(card_id)
+            if entry is None:
+                # Picture left by a version without index, keep it only if it is whole
+                if not self._adopt(card_id):
+                    return None
+                self.evict(keep=card_id)
+                return path
+            try:
+                if path.stat().st_size != entry["size"]:
+                    raise OSError
+            except OSError:
+                self._drop(card_id)
+                return None
+            entry["used"] = time.time()
+            return path
+
+    def etag(self, card_id):
+        with self.lock:
+            entry = self.index.get(str(card_id))
+            return entry.get("etag") if entry else None
+
+    def put(self, card_id, data, etag=None):
+        card_id = str(card_id)
+        if not jpeg_complete(data):
+            raise ValueError(f"Incomplete picture for card {card_id}")
+        path = self.path(card_id)
+        atomic_write(path, data)
+        with self.lock:
+            self._index(card_id, data, etag)
+            self.evict(keep=card_id)
+        return path
+
+    def _index(self, card_id, data, etag=None):
+        now = time.time()
+        old = self.index.get(card_id)
+        if old is not None:
+            self.bytes -= old["size"]
+        self.index[card_id] = dict(sha256=hashlib.sha256(data).hexdigest(), size=len(data), fetched=now, used=now, etag=etag)
+        self.bytes += len(data)
+
+    def _adopt(self, card_id):
+        """Indexes an unindexed <id>.jpg if it is whole, True if it was. A truncated one is removed."""
+        path = self.path(card_id)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return False
+        if not jpeg_complete(data):
+            path.unlink(missing_ok=True)
+            return False
+        self._index(card_id, data)
+        return True
+
+    def _unindexed(self):
+        return [path.stem for path in self.dir.glob("*.jpg") if path.stem not in self.index]
+
+    def touch(self, card_id):
+        with self.lock:
+            entry = self.index.get(str(card_id))
+            if entry is not None:
+                entry["used"] = entry["fetched"] = time.time()
+
+    def _drop(self, card_id):
+        entry = self.index.pop(card_id, None)
+        if entry is not None:
+            self.bytes -= entry["size"]
+        self.path(card_id).unlink(missing_ok=True)
+
+    def evict(self, keep=None):
+        freed = 0
+        with self.lock:
+            # Only sorts the index when something has to go
+            if self.bytes <= self.maxBytes:
+                return 0
+            for card_id in sorted(self.index, key=lambda k: self.index[k]["used"]):
+                if self.bytes <= self.maxBytes:
+                    break
+                if card_id == keep:
+                    continue
+                freed += self.index[card_id]["size"]
+                self._drop(card_id)
+        return freed
+
+    def verify(self):
+        """Re-hashes every picture, drops the ones that are missing or corrupted. Returns their ids.
+        Whole pictures missing from the index (left by older versions) are added to it."""
+        bad = []
+        with self.lock:
+            for card_id in self._unindexed():
+                if not self._adopt(card_id):
+                    bad.append(card_id)
+            for card_id, entry in list(self.index.items()):
+                try:
+                    data = self.path(card_id).read_bytes()
+                except OSError:
+                    data = None
+                if data is None or hashlib.sha256(data).hexdigest() != entry["sha256"] or not jpeg_complete(data):
+                    self._drop(card_id)
+                    bad.append(card_id)
+            self.save()
+        return bad
+
+    def gc(self):
+        """Removes leftover temp files and truncated pictures, indexes the whole ones it didn't know,
+        then evicts down to the byte budget. Returns the number of bytes freed."""
+        freed = 0
+        with self.lock:
+            for path in self.dir.glob(".tmp-*"):
+                freed += path.stat().st_size
+                path.unlink()
+            for card_id in self._unindexed():
+                size = self.path(card_id).stat().st_size
+                if not self._adopt(card_id):
+                    freed += size
+            for card_id in [k for k in self.index if not self.path(k).exists()]:
+                self._drop(card_id)
+            freed += self.evict()
+            self.save()
+        return freed
+
+def main(argv=None, directory=None):
+    parser = argparse.ArgumentParser(prog="pic_cache", description="Maintenance of the downloaded card pictures")
+    parser.add_argument("action", choices=["gc", "verify", "stats"])
+    parser.add_argument("--dir", default=directory, required=directory is None, help="pictures folder")
+    parser.add_argument("--max-mb", type=float, help="byte budget in MiB for gc")
+    args = parser.parse_args(argv)
+    cache = PicCache(args.dir)
+    if args.max_mb is not None:
+        cache.maxBytes = int(args.max_mb*1024**2)
+    if args.action == "verify":
+        bad = cache.verify()
+        print(f"{len(bad)} corrupted pictures removed" + (": " + ", ".join(bad) if bad else ""))
+    elif args.action == "gc":
+        print(f"{cache.gc()/1024**2:.1f} MiB freed")
+    print(f"{len(cache.index)} pictures, {cache.totalBytes()/1024**2:.1f} MiB")
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import hashlib, json, os, threading, time
+from pathlib import Path
+
+from pic_cache import atomic_write
+
+INDEX_NAME = "index.json"
+DEFAULT_MAX_BYTES = 1024**3
+# Entries start with a line of JSON parameters so other processes can pick them up without the index
+FORMAT = 2
+# A claim older than this belongs to a process that died while encoding
+CLAIM_TIMEOUT = 120
+
+class RenderCache:
+    """Card images already resampled and encoded, ready to embed, stored as <key>.img plus an
+    index of key -> size and last use. Kept under max_bytes by evicting the least recently used ones.
+    Counts hits and misses since it was opened.
+
+    Several processes can share the directory: entries put by one are found by the others right
+    away, and claim() lets a single process encode an image the others are waiting for."""
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.maxBytes = max_bytes
+        self.lock = threading.RLock()
+        self.hits = self.misses = 0
+        self.index = self._loadIndex()
+        self.bytes = sum(entry["size"] for entry in self.index.values())
+        self._claims = set()
+
+    def _loadIndex(self):
+        try:
+            with (self.dir/INDEX_NAME).open("r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if isinstance(index, dict) and index.get("format") == FORMAT:
+            return index["entries"]
+        # Older layout, nothing in it can be read anymore
+        for path in self.dir.glob("*.bin"):
+            path.unlink(missing_ok=True)
+        return {}
+
+    @staticmethod
+    def key(digest, slot_size, dpi, quality):
+        """digest is the hash of the source, quality anything else the encoded bytes depend on."""
+        return hashlib.sha1(f"{digest}|{slot_size[0]}x{slot_size[1]}|{dpi}|{quality}".encode()).hexdigest()
+
+    def path(self, key):
+        return self.dir/f"{key}.img"
+
+    def _claimPath(self, key):
+        return self.dir/f"{key}.claim"
+
+    def _read(self, key):
+        try:
+            params, _, data = self.path(key).read_bytes().partition(b"\n")
+            return json.loads(params), data
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """Returns (params, data) or None."""
+        with self.lock:
+            entry = self.index.get(key)
+        # Even without an index entry it may have been put by another process meanwhile.
+        # Read without the lock, other threads keep looking up and putting their own entries
+        found = self._read(key)
+        with self.lock:
+            current = self.index.get(key)
+            if found is not None and (current is None or len(found[1]) == current["size"]):
+                if current is None:
+                    current = self.index[key] = dict(size=len(found[1]), used=0)
+                    self.bytes += current["size"]
+                current["used"] = time.time()
+                self.hits += 1
+                return found
+            # Unless another thread put it again while reading, the entry is broken
+            if current is not None and current is entry:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def claim(self, key):
+        """True if this process should encode the image, False if another one already is:
+        wait() for its entry then. Released by put() or release()."""
+        path = self._claimPath(key)
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                with self.lock:
+                    self._claims.add(key)
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - path.stat().st_mtime < CLAIM_TIMEOUT:
+                        return False
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def wait(self, key, poll=0.05):
+        """Entry of a key claimed by another process, None if it gave up without putting it."""
+        path = self._claimPath(key)
+        while path.exists() and time.time() - path.stat().st_mtime < CLAIM_TIMEOUT:
+            if self.path(key).exists():
+                break
+            time.sleep(poll)
+        with self.lock:
+            # The wait itself was the miss
+            self.misses -= 1
+            return self.get(key)
+
+    def release(self, key):
+        with self.lock:
+            if key in self._claims:
+                self._claims.discard(key)
+                self._claimPath(key).unlink(missing_ok=True)
+
+    def put(self, key, params, data):
+        atomic_write(self.path(key), json.dumps(params, separators=(",", ":")).encode() + b"\n" + data)
+        self.release(key)
+        with self.lock:
+            if key in self.index:
+                self.bytes -= self.index[key]["size"]
+            self.index[key] = dict(size=len(data), used=time.time())
+            self.bytes += len(data)
+            self.evict(keep=key)
+
+    def _drop(self, key):
+        entry = self.index.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry["size"]
+        self.path(key).unlink(missing_ok=True)
+
+    def evict(self, keep=None):
+        with self.lock:
+            for key in sorted(self.index, key=lambda k: self.index[k]["used"]):
+                if self.bytes <= self.maxBytes:
+                    break
+                if key != keep:
+                    self._drop(key)
+
+    def save(self):
+        # Only the index, entries are written as soon as they are put. Entries other processes
+        # added meanwhile are kept, unless their file is gone (evicted)
+        with self.lock:
+            try:
+                with (self.dir/INDEX_NAME).open("r") as f:
+                    disk = json.load(f)
+                if disk.get("format") == FORMAT:
+                    for key, entry in disk["entries"].items():
+                        if key not in self.index and self.path(key).exists():
+                            self.index[key] = entry
+                            self.bytes += entry["size"]
+            except (OSError, ValueError, AttributeError):
+                pass
+            data = json.dumps(dict(format=FORMAT, entries=self.index), separators=(",", ":")).encode()
+        atomic_write(self.dir/INDEX_NAME, data)
+
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, entries=len(self.index), bytes=self.bytes)
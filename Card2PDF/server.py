@@ -0,0 +1,362 @@
+"""Headless render service, exports the jobs posted to a local HTTP API on a pool of processes.
+
+    python Card2PDF/server.py [--port 8620] [--workers 2]
+
+POST /jobs           {"cards": [{"path": "pics/89631139.jpg", "copies": 3, "format": "Yugioh"}, ...] or
+                      "deck": "<deck code>", plus optional "format", "paper" and "profile"}
+                     202 with the status of the new job
+GET /jobs            status of every job
+GET /jobs/<id>       status of the job, ?wait=<seconds> waits for it to finish first (up to 300 s)
+GET /jobs/<id>/pdf   the PDF once done (?wait=<seconds> too), 202 with the status while it isn't,
+                     409 when it failed or was cancelled
+DELETE /jobs/<id>    cancels the job, or forgets a finished one and removes its PDF
+"""
+import argparse, json, math, os, shutil, signal, sys, threading, time, uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from multiprocessing.managers import SyncManager
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from card2pdf import deck_cards
+from export_worker import ExportJob
+from jobs import ACTIVE, CANCELLED, DONE, FAILED, _init_worker, _run_job, finish_job, job_event, new_job
+from settings import DATA_DIR, RENDER_DIR, load_settings
+
+DEFAULT_PORT = 8620
+# Finished jobs kept, with their PDFs, before the oldest ones are forgotten
+DEFAULT_KEEP = 100
+MAX_BODY = 16*1024**2
+MAX_WAIT = 300
+
+def _ignore_sigint():
+    # Ctrl-C stops the server, which then cancels the jobs and stops its processes itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _init_service_worker(*args):
+    _ignore_sigint()
+    _init_worker(*args)
+
+class RenderService:
+    """Runs the jobs of the API on a pool of `workers` processes that stay up between requests,
+    each one keeping its decoded images and all of them sharing the render cache.
+    `jobs` (id -> status dict) is guarded by `changed`, notified on every update."""
+    def __init__(self, settings, workers, out_dir, keep=DEFAULT_KEEP):
+        self.settings = settings
+        self.outDir = Path(out_dir)
+        self.outDir.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+        self.jobs = {}
+        self.changed = threading.Condition()
+        self._futures = {}
+        self._cancels = {}
+        context = get_context("spawn")
+        self.manager = SyncManager(ctx=context)
+        self.manager.start(_ignore_sigint)
+        self.events = self.manager.Queue()
+        self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_service_worker,
+                                        initargs=(int(settings["Image Memory MB"]*1024**2), str(RENDER_DIR),
+                                                  int(settings["Render Cache MB"]*1024**2)))
+        # Pictures of a deck are downloaded in parallel, but one deck at a time
+        self.decks = ThreadPoolExecutor(1)
+        threading.Thread(target=self._readEvents, daemon=True).start()
+        # Starts every process now, importing Qt shouldn't count against the first requests
+        for future in [self.pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    def submit(self, request):
+        """Queues the job of a POST /jobs body and returns its status, ValueError if the body is wrong."""
+        settings = self.settings
+        if not isinstance(request, dict) or ("cards" in request) == ("deck" in request):
+            raise ValueError("expected an object with either cards or deck")
+        profile = request.get("profile", settings["Export Profile"])
+        if profile not in settings["Export Profiles"]:
+            raise ValueError(f"unknown export profile {profile!r}, choose from {list(settings['Export Profiles'])}")
+        paper_name = request.get("paper", next(iter(settings["Paper Formats"])))
+        if paper_name not in settings["Paper Formats"]:
+            raise ValueError(f"unknown paper format {paper_name!r}, choose from {list(settings['Paper Formats'])}")
+        card_name = request.get("format", "Yugioh" if "deck" in request else next(iter(settings["Card Formats"])))
+        if card_name not in settings["Card Formats"]:
+            raise ValueError(f"unknown card format {card_name!r}, choose from {list(settings['Card Formats'])}")
+        job_id = uuid.uuid4().hex[:12]
+        file_name = str(self.outDir/f"{job_id}.pdf")
+        if "deck" in request:
+            if not isinstance(request["deck"], str):
+                raise ValueError("deck must be a deck code")
+            with self.changed:
+                self.jobs[job_id] = new_job(job_id, file_name, profile, None)
+            self.decks.submit(self._downloadDeck, job_id, request["deck"], paper_name, profile, card_name)
+            return self.status(job_id)
+        paths, copies, formats = self._parseCards(request["cards"], card_name)
+        with self.changed:
+            self.jobs[job_id] = new_job(job_id, file_name, profile, sum(copies))
+        self._start(job_id, ExportJob(file_name, settings, paper_name, profile, paths, copies, formats))
+        return self.status(job_id)
+
+    def _parseCards(self, cards, card_name):
+        if not isinstance(cards, list) or not cards:
+            raise ValueError("cards must be a non empty list")
+        paths, copies, formats = [], [], []
+        for card in cards:
+            if not isinstance(card, dict) or not isinstance(card.get("path"), str):
+                raise ValueError("every card needs a path")
+            num = card.get("copies", 1)
+            if not isinstance(num, int) or num < 0:
+                raise ValueError(f"bad number of copies for {card['path']}")
+            name = card.get("format", card_name)
+            if name not in self.settings["Card Formats"]:
+                raise ValueError(f"unknown card format {name!r}")
+            # Relative to the directory the server was started from
+            path = Path(card["path"]).expanduser().resolve()
+            if not path.is_file():
+                raise ValueError(f"no image at {card['path']}")
+            paths.append(str(path))
+            copies.append(num)
+            formats.append(name)
+        if not sum(copies):
+            raise ValueError("no card has any copies")
+        return paths, copies, formats
+
+    def _downloadDeck(self, job_id, code, paper_name, profile, card_name):
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None or job["state"] not in ACTIVE:
+                return
+        try:
+            cards = deck_cards(code, self.settings)
+        except Exception as e:
+            with self.changed:
+                job.update(state=FAILED, finished=time.time(), error=str(e) or type(e).__name__)
+                self.changed.notify_all()
+            return
+        with self.changed:
+            # Cancelled while downloading
+            if job["state"] not in ACTIVE:
+                return
+            job["cards"] = sum(copies for _, copies in cards)
+        self._start(job_id, ExportJob(job["file"], self.settings, paper_name, profile, [path for path, _ in cards],
+                                      [copies for _, copies in cards], [card_name]*len(cards)))
+
+    def _start(self, job_id, job):
+        cancel = self.manager.Event()
+        with self.changed:
+            future = self.pool.submit(_run_job, job_id, job, self.events, cancel)
+            self._futures[job_id] = future
+            self._cancels[job_id] = cancel
+            self.changed.notify_all()
+        future.add_done_callback(lambda future: self._finished(job_id, future))
+
+    def _readEvents(self):
+        while True:
+            try:
+                event = self.events.get()
+            except (OSError, EOFError):
+                # The manager was shut down
+                return
+            with self.changed:
+                job = self.jobs.get(event[1])
+                if job is not None and job["state"] in ACTIVE:
+                    job_event(job, event)
+                    self.changed.notify_all()
+
+    def _finished(self, job_id, future):
+        with self.changed:
+            self._futures.pop(job_id, None)
+            self._cancels.pop(job_id, None)
+            job = self.jobs.get(job_id)
+            if job is not None:
+                finish_job(job, future)
+            finished = [old for old, job in self.jobs.items() if job["state"] not in ACTIVE]
+            for old in finished[:max(0, len(finished) - self.keep)]:
+                self._forget(old)
+            self.changed.notify_all()
+
+    def status(self, job_id):
+        with self.changed:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job, pdf=f"/jobs/{job_id}/pdf")
+
+    def wait(self, job_id, timeout):
+        """Status of the job once it finishes, or after timeout seconds."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.jobs.get(job_id, {}).get("state") not in ACTIVE, timeout)
+            return self.status(job_id)
+
+    def cancel(self, job_id):
+        """Cancels an unfinished job, forgets a finished one. Returns its last status."""
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["state"] not in ACTIVE:
+                status = self.status(job_id)
+                self._forget(job_id)
+                return status
+            if job_id not in self._futures:
+                # Still downloading its deck
+                job.update(state=CANCELLED, finished=time.time())
+            elif not self._futures[job_id].cancel():
+                # Stops at its next card, the partial PDF is removed
+                self._cancels[job_id].set()
+            self.changed.notify_all()
+            return self.status(job_id)
+
+    def _forget(self, job_id):
+        job = self.jobs.pop(job_id)
+        Path(job["file"]).unlink(missing_ok=True)
+        Path(job["file"]).with_suffix(".layout.json").unlink(missing_ok=True)
+
+    def shutdown(self):
+        with self.changed:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job["state"] in ACTIVE]:
+                self.cancel(job_id)
+        self.decks.shutdown(wait=True, cancel_futures=True)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "Card2PDF"
+    # Headers and body are separate writes, Nagle would hold the body until the client acks
+    disable_nagle_algorithm = True
+
+    def _json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message):
+        self._json(code, dict(error=message))
+
+    def _route(self):
+        """Path parts and the seconds to wait, None when ?wait isn't a number of seconds."""
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        wait = 0
+        if "wait" in query:
+            try:
+                wait = float(query["wait"][0])
+            except ValueError:
+                wait = None
+            else:
+                wait = min(wait, MAX_WAIT) if math.isfinite(wait) and wait >= 0 else None
+        return [part for part in url.path.split("/") if part], wait
+
+    def _contentLength(self):
+        """The Content-Length header, None unless it is a plain non-negative integer."""
+        length = self.headers.get("Content-Length") or "0"
+        # int() would also take "+1", " 1" or "1_0"
+        return int(length) if length.isascii() and length.isdigit() else None
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ["jobs"]:
+            return self._error(404, "not found")
+        length = self._contentLength()
+        if length is None:
+            # The body can't be skipped without its length
+            self.close_connection = True
+            return self._error(400, "invalid Content-Length")
+        if length > MAX_BODY:
+            self.close_connection = True
+            return self._error(413, "request too large")
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self._error(400, "the body is not valid JSON")
+        try:
+            status = self.server.service.submit(request)
+        except ValueError as e:
+            return self._error(400, str(e))
+        self._json(202, status)
+
+    def do_GET(self):
+        parts, wait = self._route()
+        if wait is None:
+            return self._error(400, "wait has to be a number of seconds")
+        service = self.server.service
+        if parts == ["jobs"]:
+            with service.changed:
+                return self._json(200, [service.status(job_id) for job_id in service.jobs])
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or parts[2:] not in ([], ["pdf"]):
+            return self._error(404, "not found")
+        status = service.wait(parts[1], wait) if wait else service.status(parts[1])
+        if status is None:
+            return self._error(404, "no such job")
+        if len(parts) == 2:
+            return self._json(200, status)
+        if status["state"] in ACTIVE:
+            return self._json(202, status)
+        if status["state"] != DONE:
+            return self._json(409, status)
+        self._sendPDF(status["file"])
+
+    def _sendPDF(self, path):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return self._error(404, "the PDF was removed")
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Content-Disposition", f'attachment; filename="{Path(path).name}"')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, 256*1024)
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._error(404, "not found")
+        status = self.server.service.cancel(parts[1])
+        if status is None:
+            return self._error(404, "no such job")
+        self._json(200, status)
+
+    def log_message(self, *args):
+        if not self.server.quiet:
+            super().log_message(*args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="card2pdf-server", description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, only this machine by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="0 picks a free one")
+    parser.add_argument("--workers", type=int, help="export processes, defaults to \"Parallel Exports\" from Settings.json")
+    parser.add_argument("-o", "--output-dir", default=str(DATA_DIR/"served"), help="where the PDFs of the jobs are written")
+    parser.add_argument("--keep", type=int, default=DEFAULT_KEEP, help="finished jobs kept before the oldest are removed")
+    parser.add_argument("--settings", help="alternative Settings.json")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't log every request")
+    args = parser.parse_args(argv)
+    settings = load_settings(args.settings) if args.settings else load_settings()
+    workers = args.workers or settings["Parallel Exports"]
+    if workers < 1:
+        parser.error("--workers has to be at least 1")
+
+    service = RenderService(settings, workers, args.output_dir, max(0, args.keep))
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = args.quiet
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port}/ with {workers} export processes", flush=True)
+
+    def stop(*args):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
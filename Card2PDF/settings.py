@@ -0,0 +1,124 @@
+import json, os, sys
+from pathlib import Path
+
+from CardPDFWriter import IMAGE_ENCODINGS, CardPDFWriter, Resample
+from NativePDFWriter import NativePDFWriter
+from layout import CUT_LINES, PACKINGS
+
+BASE_DIR = Path(__file__).resolve().parent
+SETTINGS_FILE = BASE_DIR/"Settings.json"
+# Next to the script or the exe like the pics folder, __file__ is a temporary folder in the onefile exe
+DATA_DIR = Path(sys.argv[0]).resolve().parent
+RENDER_DIR = DATA_DIR/"renders"
+THUMB_DIR = DATA_DIR/"thumbs"
+PDF_ENGINES = {"Qt": CardPDFWriter, "Native": NativePDFWriter}
+
+def check_formats_ok(formats):
+    try:
+        if isinstance(formats, (tuple, list)):
+            assert len(formats) == 2
+            for x in formats:
+                assert isinstance(x, (int, float))
+            return True
+        elif isinstance(formats, dict):
+            for val in formats.values():
+                assert check_formats_ok(val)
+        else:
+            return False
+    except AssertionError:
+        return False
+    return True
+
+def check_profiles_ok(profiles):
+    # Every profile needs all of its keys, a half written one would silently fall back to "print"
+    if not isinstance(profiles, dict) or not profiles:
+        return False
+    for profile in profiles.values():
+        if not isinstance(profile, dict):
+            return False
+        if not isinstance(profile.get("DPI"), (int, float)) or profile["DPI"] <= 0:
+            return False
+        if profile.get("Image Encoding") not in IMAGE_ENCODINGS:
+            return False
+        if not isinstance(profile.get("Quality"), int) or not 0 <= profile["Quality"] <= 100:
+            return False
+        if not isinstance(profile.get("Compression"), int) or not 0 <= profile["Compression"] <= 9:
+            return False
+    return True
+
+def load_settings(path=SETTINGS_FILE):
+    # Config File
+    try:
+        with Path(path).open('r') as f:
+            _config = json.load(f)
+    except:
+        _config = {}
+    # Defaults
+    settings = {}
+    settings["Paper Formats"] = {"Ledger 432x279 mm": [432, 279]}
+    settings["Card Formats"] = dict(Pokemon=[63, 88], Yugioh=[59, 85.5])
+    settings["Export Profiles"] = {
+        "draft": {"DPI": 150, "Image Encoding": "JPEG", "Quality": 60, "Compression": 1},
+        "print": {"DPI": 300, "Image Encoding": "Auto", "Quality": 92, "Compression": 6},
+        "archive": {"DPI": 300, "Image Encoding": "Flate", "Quality": 100, "Compression": 9},
+    }
+    settings["Export Profile"] = "print"
+    settings["Separation"] = [0.8, 0.8]
+    settings["YGOPro Deck Folder"] = str(BASE_DIR.parent)
+    settings["Resample"] = Resample.SMOOTH.name
+    settings["PDF Engine"] = "Qt"
+    settings["Packing"] = "Upright"
+    settings["Cut Lines"] = "Full"
+    settings["Cut Line Width"] = 1 # mm
+    settings["Export Threads"] = os.cpu_count() or 1
+    settings["Parallel Exports"] = 2 # export jobs running at once, each one in its own process
+    settings["Download Threads"] = 8
+    settings["Download Rate"] = 20 # requests per second to the same host
+    settings["Pic Cache MB"] = 2048
+    settings["Image Memory MB"] = 256 # decoded card images kept between exports
+    settings["Render Cache MB"] = 1024 # card images resampled (and encoded by the Native engine) in earlier exports
+    # Read and check config
+    if "Paper Formats" in _config and check_formats_ok(_config["Paper Formats"]):
+        settings["Paper Formats"] = _config["Paper Formats"]
+    if "Card Formats" in _config and check_formats_ok(_config["Card Formats"]):
+        settings["Card Formats"] = _config["Card Formats"]
+    if "Export Profiles" in _config and check_profiles_ok(_config["Export Profiles"]):
+        settings["Export Profiles"] = _config["Export Profiles"]
+    if _config.get("Export Profile") in settings["Export Profiles"]:
+        settings["Export Profile"] = _config["Export Profile"]
+    elif settings["Export Profile"] not in settings["Export Profiles"]:
+        settings["Export Profile"] = next(iter(settings["Export Profiles"]))
+    if "Separation" in _config and check_formats_ok(_config["Separation"]):
+        settings["Separation"] = _config["Separation"]
+    if "YGOPro Deck Folder" in _config and Path(str(_config["YGOPro Deck Folder"])).resolve().exists():
+        settings["YGOPro Deck Folder"] = _config["YGOPro Deck Folder"]
+    if "Resample" in _config and str(_config["Resample"]).upper() in Resample.__members__:
+        settings["Resample"] = str(_config["Resample"]).upper()
+    if _config.get("PDF Engine") in PDF_ENGINES:
+        settings["PDF Engine"] = _config["PDF Engine"]
+    if _config.get("Packing") in PACKINGS:
+        settings["Packing"] = _config["Packing"]
+    if _config.get("Cut Lines") in CUT_LINES:
+        settings["Cut Lines"] = _config["Cut Lines"]
+    if isinstance(_config.get("Cut Line Width"), (int, float)) and _config["Cut Line Width"] > 0:
+        settings["Cut Line Width"] = _config["Cut Line Width"]
+    if isinstance(_config.get("Export Threads"), int) and _config["Export Threads"] > 0:
+        settings["Export Threads"] = _config["Export Threads"]
+    if isinstance(_config.get("Parallel Exports"), int) and _config["Parallel Exports"] > 0:
+        settings["Parallel Exports"] = _config["Parallel Exports"]
+    if isinstance(_config.get("Download Threads"), int) and _config["Download Threads"] > 0:
+        settings["Download Threads"] = _config["Download Threads"]
+    if isinstance(_config.get("Download Rate"), (int, float)) and _config["Download Rate"] >= 0:
+        settings["Download Rate"] = _config["Download Rate"]
+    if isinstance(_config.get("Pic Cache MB"), (int, float)) and _config["Pic Cache MB"] > 0:
+        settings["Pic Cache MB"] = _config["Pic Cache MB"]
+    if isinstance(_config.get("Image Memory MB"), (int, float)) and _config["Image Memory MB"] >= 0:
+        settings["Image Memory MB"] = _config["Image Memory MB"]
+    if isinstance(_config.get("Render Cache MB"), (int, float)) and _config["Render Cache MB"] >= 0:
+        settings["Render Cache MB"] = _config["Render Cache MB"]
+    return settings
+
+def flush_settings(settings, path=SETTINGS_FILE):
+    with Path(path).open('w') as f:
+        json.dump(settings, f, indent=2)
+        f.flush()
@@ -0,0 +1,73 @@
+import hashlib, os
+from pathlib import Path
+
+from PyQt5.QtCore import QObject, QRunnable, QSize, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+THUMBNAIL_SIZE = QSize(50, 70)
+# Part of the key of the saved thumbnails, older ones were turned by their EXIF orientation
+FORMAT = 2
+
+def load_thumbnail(path, size=THUMBNAIL_SIZE):
+    # Lets the decoder skip most of the work (JPEGs are decoded straight at a fraction of their size)
+    reader = QImageReader(str(path))
+    # No EXIF rotation, both PDF engines draw the pixels as they are stored and the preview has to match
+    reader.setAutoTransform(False)
+    reader.setScaledSize(size)
+    return reader.read()
+
+class ThumbnailCache:
+    """Thumbnails saved as PNG, keyed by the image path, modification time and size."""
+    def __init__(self, directory):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, path):
+        st = os.stat(path)
+        key = f"{FORMAT}|{Path(path).resolve()}|{st.st_mtime_ns}|{st.st_size}"
+        return self.dir/(hashlib.sha1(key.encode()).hexdigest() + ".png")
+
+    def get(self, path):
+        try:
+            img = QImage(str(self._file(path)))
+        except OSError:
+            return None
+        return None if img.isNull() else img
+
+    def put(self, path, img):
+        try:
+            target = self._file(path)
+        except OSError:
+            return
+        tmp = target.with_name(f".tmp-{os.getpid()}-{id(img)}.png")
+        if img.save(str(tmp), "PNG"):
+            os.replace(tmp, target)
+
+    def load(self, path):
+        img = self.get(path)
+        if img is None:
+            img = load_thumbnail(path)
+            if not img.isNull():
+                self.put(path, img)
+        return img
+
+class _ThumbnailTask(QRunnable):
+    def __init__(self, path, loader):
+        super().__init__()
+        self.path = path
+        self.loader = loader
+
+    def run(self):
+        self.loader.ready.emit(self.path, self.loader.cache.load(self.path))
+
+class ThumbnailLoader(QObject):
+    """Decodes thumbnails on a thread pool, `ready` is emitted in the GUI thread as each one finishes."""
+    ready = pyqtSignal(str, QImage)
+
+    def __init__(self, cache_dir, parent=None):
+        super().__init__(parent)
+        self.cache = ThumbnailCache(cache_dir)
+        self.pool = QThreadPool(self)
+
+    def request(self, path):
+        self.pool.start(_ThumbnailTask(str(path), self))
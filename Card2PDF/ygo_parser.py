@@ -1,38 +1,57 @@
 import sys
 from pathlib import Path
-from collections import defaultdict, Counter
-import zlib, base64
+from collections import Counter
+import zlib, base64, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt5 import QtCore, QtGui, QtWidgets
 import requests
 
+from downloader import Downloader, default_downloader
+from instrument import Recorder, StageSummary, env_sink
+from pic_cache import PicCache
+
 BASE_DIR = Path(sys.argv[0]).resolve().parent
 PIC_DIR = BASE_DIR/"pics"
 PIC_DIR.mkdir(exist_ok=True)
+PIC_CACHE = PicCache(PIC_DIR)
 BASE_URL = "https://images.ygoprodeck.com/images/cards/"
 
-HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-
-def download_file(url, path):
-    r = requests.get(url, headers=HEADERS)
-    if r.status_code != 200:
-        print(f"Error downloading {url}")
-        return False
-    with path.open('wb') as f:
-        f.write(r.content)
-    return True
-
-def download_pic_by_id(card_id):
-    path = (PIC_DIR/card_id).with_suffix(".jpg")
-    if path.exists():
+def download_pic_by_id(card_id, downloader=None, base_url=None, refresh=False, recorder=None):
+    path = PIC_CACHE.get(card_id)
+    if path is not None and not refresh:
+        if recorder is not None:
+            recorder.emit("cache-hit", item=card_id)
         return path
-    if download_file(BASE_URL+card_id+".jpg", path):
+    url = (base_url or BASE_URL)+card_id+".jpg"
+    etag = PIC_CACHE.etag(card_id) if path is not None else None
+    start = time.perf_counter()
+    try:
+        r = (downloader or default_downloader()).get(url, headers={"If-None-Match": etag} if etag else None)
+    except requests.RequestException:
+        r = None
+    if recorder is not None and r is not None:
+        recorder.emit("download", time.perf_counter() - start, len(r.content), card_id)
+    if r is not None and r.status_code == 304:
+        if recorder is not None:
+            recorder.emit("cache-hit", item=card_id)
+        PIC_CACHE.touch(card_id)
         return path
-    return None
+    if r is None or r.status_code != 200:
+        print(f"Error downloading {url}")
+        return None
+    try:
+        return PIC_CACHE.put(card_id, r.content, r.headers.get("ETag"))
+    except ValueError:
+        print(f"Error downloading {url}, incomplete picture")
+        return None
 
 def parse_ygo_deck():
     cb_contents = QtGui.QGuiApplication.clipboard().text()
     print(cb_contents)
-    byte_data = zlib.decompress(base64.b64decode(cb_contents), -8)
+    return decode_ygo_deck(cb_contents)
+
+def decode_ygo_deck(code):
+    byte_data = zlib.decompress(base64.b64decode(code), -8)
     ids = [int.from_bytes(byte_data[i:i+4], 'little') for i in range(2, len(byte_data[2:]), 4)]
     return Counter(ids[:byte_data[0]+byte_data[1]])
 
@@ -57,24 +76,49 @@ class DialogPBar(QtWidgets.QDialog):
         self.status.setGeometry(QtCore.QRect(50, 130, 370, 30))
         self.status.setAlignment(QtCore.Qt.AlignCenter)
         self.status.setObjectName("status")
+
+        self.cancelButton = QtWidgets.QPushButton(self)
+        self.cancelButton.setGeometry(QtCore.QRect(410, 80, 70, 30))
+        self.cancelButton.setObjectName("cancelButton")
+        self.cancelButton.setText("Cancel")
     
     @QtCore.pyqtSlot(str)
     def updateStatus(self, msg):
         self.status.setText(msg)
 
 class Worker(QtCore.QThread):
-    def __init__(self, parent, iterable, work):
+    def __init__(self, parent, iterable, work, max_workers=1):
         super().__init__(parent)
         self.iterable = iterable
         self.work = work
+        self.maxWorkers = max_workers
+        # Cancellation token, checked before every item starts
+        self.cancelled = threading.Event()
     countChanged = QtCore.pyqtSignal(int)
     valChanged = QtCore.pyqtSignal(str)
+    # (item, result of work) as soon as each one is done
+    resultReady = QtCore.pyqtSignal(object, object)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _work(self, val):
+        if self.cancelled.is_set():
+            return None
+        return self.work(val)
+
     def run(self):
         n = len(self.iterable)
-        for it, val in enumerate(self.iterable):
-            self.valChanged.emit(f"{val} -- {it+1}/{n}")
-            self.work(val)
-            self.countChanged.emit(100*(it+1)//n)
+        with ThreadPoolExecutor(self.maxWorkers) as pool:
+            futures = {pool.submit(self._work, val): val for val in self.iterable}
+            for it, future in enumerate(as_completed(futures)):
+                if self.cancelled.is_set():
+                    for f in futures:
+                        f.cancel()
+                    break
+                self.valChanged.emit(f"{futures[future]} -- {it+1}/{n}")
+                self.resultReady.emit(futures[future], future.result())
+                self.countChanged.emit(100*(it+1)//n)
 
 class YGOProParser:
     def __init__(self, parent):
@@ -89,50 +133,63 @@ class YGOProParser:
         parent.actionYGOProDeck.setText("Import Omega Code from clipboard")
         parent.menubar.addAction(parent.menuYGOPro.menuAction())
         parent.actionYGOProDeck.triggered.connect(self.parseYGOProDeck)
+        self.worker = None
     
     def parseYGOProDeck(self):
+        if self.worker is not None:
+            return
         try:
             card2num = parse_ygo_deck()
-        except RuntimeError:
-            print("Error in file")
-        path2num = dict()
-        not_found = []
+        except Exception:
+            self.parent.statusbar.showMessage("The clipboard does not contain a valid deck code")
+            return
+        self.card2num = card2num
+        self.notFound = []
         # Progressbar dialog
         dia = DialogPBar(self.parent, "Downloading...", "Downloading Pics From YGOPro...")
         dia.progress.setValue(0)
-        # Define work callable
-        def work(card_id):
-            path = download_pic_by_id(str(card_id))
-            if path is None:
-                not_found.append(card_id)
-            else:
-                path2num[str(path)] = card2num[card_id]
-        # Define worker
-        w = Worker(dia, card2num.keys(), work)
+        settings = self.parent.settings
+        self.downloader = Downloader(settings["Download Threads"], settings["Download Rate"])
+        PIC_CACHE.maxBytes = int(settings["Pic Cache MB"]*1024**2)
+        self.summary = StageSummary()
+        self.recorder = Recorder(self.summary)
+        self.sink = env_sink(deck=True)
+        if self.sink is not None:
+            self.recorder.add(self.sink)
+        work = lambda card_id: download_pic_by_id(str(card_id), self.downloader, recorder=self.recorder)
+        # Define worker, cards are added to the table as they arrive
+        self.worker = w = Worker(dia, card2num.keys(), work, self.downloader.maxWorkers)
         w.countChanged.connect(dia.progress.setValue)
         w.valChanged.connect(dia.updateStatus)
+        w.resultReady.connect(self.addDownloadedCard)
+        w.finished.connect(self.downloadFinished)
+        dia.cancelButton.clicked.connect(w.cancel)
+        dia.rejected.connect(w.cancel)
         # Start download
         dia.show()
         w.start()
-        while w.isRunning():
-            QtCore.QCoreApplication.processEvents()
-        dia.close()
-        ## Update table
-        # Change num_copies of duplicates
-        for it, name in enumerate(self.parent.imageNames):
-            if name not in path2num:
-                continue
-            try:
-                num_copies = int(self.parent.tableWidget.item(it, 1).text())
-                assert num_copies >= 0
-            except:
-                num_copies = 0
-            num_copies += path2num.pop(name)
-            self.parent.tableWidget.setItem(it, 1, QtWidgets.QTableWidgetItem(str(num_copies)))
-        # Add new cards
-        old_len = len(self.parent.imageNames)
-        self.parent.addImgsToTable(path2num.keys())
-        for it, key in enumerate(path2num.keys()):
-            copies = str(path2num[key])
-            self.parent.tableWidget.setItem(it+old_len, 1, QtWidgets.QTableWidgetItem(copies))
-        self.parent.cardComboBox.setCurrentIndex(self.parent.cardComboBox.findText("Yugioh"))
\ No newline at end of file
+
+    def addDownloadedCard(self, card_id, path):
+        if path is None:
+            self.notFound.append(card_id)
+            return
+        copies = self.card2num[card_id]
+        # Copies of cards already in the list (same file or same picture) are merged into their row
+        card_format = "Yugioh" if "Yugioh" in self.parent.settings["Card Formats"] else None
+        self.parent.addImgsToTable([str(path)], [copies], merge=True, card_format=card_format)
+
+    def downloadFinished(self):
+        self.downloader.close()
+        if self.sink is not None:
+            self.sink.close()
+        PIC_CACHE.save()
+        cancelled = self.worker.cancelled.is_set()
+        self.worker.parent().close()
+        if cancelled:
+            self.parent.statusbar.showMessage("Deck import cancelled")
+        elif self.notFound:
+            self.parent.statusbar.showMessage(f"Could not download {len(self.notFound)} cards: "
+                                              + ", ".join(map(str, self.notFound)))
+        else:
+            self.parent.statusbar.showMessage(f"Deck imported: {self.summary.text()}")
+        self.worker = None
@@ -0,0 +1,158 @@
+"""Load test of the render service: clients posting jobs at once, reporting requests/s and latency.
+
+    python benchmarks/load_test.py [--url http://127.0.0.1:8620] [--jobs 40] [--concurrency 4] [--cards 60]
+
+Every client posts a job, waits for its PDF, downloads it and deletes the job, then starts the next one.
+Jobs are --cards synthetic card images picked out of --unique ones, so later jobs find most of their
+images already decoded and encoded in the caches of the server, like repeated orders of popular cards.
+Without --url a server is started for the test with --workers export processes and stopped at the end.
+"""
+import argparse, http.client, json, random, signal, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from suite import ROOT, card_images
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction*len(values)))] if values else 0
+
+class Client:
+    """One keep-alive connection, records the latency of every request by endpoint."""
+    def __init__(self, url, latencies, lock):
+        url = urlsplit(url)
+        self.conn = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+        self.latencies = latencies
+        self.lock = lock
+
+    def request(self, endpoint, method, path, body=None):
+        start = time.perf_counter()
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self.conn.request(method, path, None if body is None else json.dumps(body), headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        return response.status, data
+
+    def job(self, request):
+        """Posts a job and downloads its PDF, returns its size."""
+        status, data = self.request("POST /jobs", "POST", "/jobs", request)
+        if status != 202:
+            raise RuntimeError(f"POST /jobs answered {status}: {data.decode()}")
+        job_id = json.loads(data)["id"]
+        while True:
+            status, data = self.request("GET /jobs/<id>/pdf", "GET", f"/jobs/{job_id}/pdf?wait=60")
+            if status != 202:
+                break
+        self.request("DELETE /jobs/<id>", "DELETE", f"/jobs/{job_id}")
+        if status != 200:
+            raise RuntimeError(f"job {job_id} answered {status}: {data.decode()}")
+        return len(data)
+
+def start_server(workers, output_dir):
+    """Server on a free port, returns the process and its url."""
+    process = subprocess.Popen([sys.executable, str(ROOT/"Card2PDF"/"server.py"), "--port", "0", "--quiet",
+                                "--workers", str(workers), "-o", output_dir],
+                               stdout=subprocess.PIPE, text=True)
+    # "Serving on http://127.0.0.1:<port>/ ..." once the export processes are up
+    line = process.stdout.readline()
+    if not line.startswith("Serving on "):
+        process.kill()
+        raise RuntimeError("the server didn't start")
+    return process, line.split()[2]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="server to test, one is started when not given")
+    parser.add_argument("--workers", type=int, default=2, help="export processes of the server started for the test")
+    parser.add_argument("--jobs", type=int, default=40, help="jobs posted in total")
+    parser.add_argument("--concurrency", type=int, default=4, help="clients posting jobs at the same time")
+    parser.add_argument("--cards", type=int, default=60, help="different cards in every job")
+    parser.add_argument("--unique", type=int, default=120, help="different card images the jobs pick from")
+    parser.add_argument("--copies", type=int, default=1, help="copies of every card")
+    parser.add_argument("--resolution", choices=["low", "print", "high"], default="low")
+    parser.add_argument("--profile", help="export profile, the default of the server when not given")
+    parser.add_argument("--workdir", default=str(Path(tempfile.gettempdir())/"card2pdf-bench"))
+    parser.add_argument("-o", "--output", help="also save the report as JSON")
+    args = parser.parse_args(argv)
+    if args.cards > args.unique:
+        parser.error("--cards can't be more than --unique")
+
+    # In a process of its own, this one never loads Qt
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        paths = pool.submit(card_images, args.workdir, args.resolution, args.unique).result()
+    rng = random.Random(0)
+    requests = []
+    for _ in range(args.jobs):
+        request = dict(cards=[dict(path=path, copies=args.copies) for path in rng.sample(paths, args.cards)])
+        if args.profile:
+            request["profile"] = args.profile
+        requests.append(request)
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_server(args.workers, str(Path(args.workdir)/"served"))
+    latencies, jobs, errors = {}, [], []
+    lock = threading.Lock()
+    pending = iter(requests)
+
+    def client():
+        connection = Client(url, latencies, lock)
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                return
+            start = time.perf_counter()
+            try:
+                size = connection.job(request)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                jobs.append((time.perf_counter() - start, size))
+
+    try:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+    finally:
+        if server is not None:
+            # Lets it cancel its jobs and stop its processes
+            if sys.platform == "win32":
+                server.terminate()
+            else:
+                server.send_signal(signal.SIGINT)
+            server.wait()
+
+    requests_done = sum(len(values) for values in latencies.values())
+    job_times = [seconds for seconds, _ in jobs]
+    print(f"{len(jobs)} jobs of {args.cards} cards by {args.concurrency} clients in {wall:.2f} s, {len(errors)} failed")
+    print(f"{len(jobs)/wall:.2f} jobs/s, {requests_done/wall:.2f} requests/s, "
+          f"{sum(size for _, size in jobs)/1024**2/wall:.1f} MB/s of PDF")
+    print(f"{'':<20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    rows = dict(latencies, job=job_times)
+    for name, values in rows.items():
+        print(f"{name:<20} {len(values):>6} {percentile(values, 0.5)*1000:>9.1f} "
+              f"{percentile(values, 0.95)*1000:>9.1f} {max(values, default=0)*1000:>9.1f}")
+    for error in errors[:5]:
+        print(f"error: {error}", file=sys.stderr)
+    if args.output:
+        report = dict(url=url, jobs=len(jobs), failed=len(errors), concurrency=args.concurrency, cards=args.cards,
+                      wall=wall, jobs_per_s=len(jobs)/wall, requests_per_s=requests_done/wall,
+                      latency={name: dict(count=len(values), p50=percentile(values, 0.5), p95=percentile(values, 0.95),
+                                          max=max(values, default=0)) for name, values in rows.items()})
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Paper used and planning time of the mixed format packer against one grid export per format.
+
+    python benchmarks/pack_layout.py [--paper 432 279] [--sizes 1000 2000 5000 10000]
+"""
+import argparse, random, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"Card2PDF"))
+
+from layout import PackedLayout, SheetLayout
+
+CARD_FORMATS = dict(Pokemon=[63, 88], Yugioh=[59, 85.5], Tarot=[70, 120], Mini=[41, 63])
+
+def make_deck(num_cards, rng):
+    """Random order of about num_cards copies, 1 to 4 copies of each card."""
+    formats, copies = [], []
+    while sum(copies) < num_cards:
+        formats.append(rng.choice(list(CARD_FORMATS.values())))
+        copies.append(min(rng.randint(1, 4), num_cards - sum(copies)))
+    return formats, copies
+
+def grid_sheets(formats, copies, paper, separation):
+    # What exporting every format to its own PDF takes
+    sheets, area = 0, 0
+    for card_format in map(list, {tuple(f) for f in formats}):
+        total = sum(c for f, c in zip(formats, copies) if f == card_format)
+        sheets += SheetLayout(card_format, paper, separation).sheetCount([total])
+        area += total*card_format[0]*card_format[1]
+    return sheets, area/(sheets*paper[0]*paper[1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paper", nargs=2, type=float, default=[432, 279], metavar=("W", "H"))
+    parser.add_argument("--separation", nargs=2, type=float, default=[0.8, 0.8], metavar=("X", "Y"))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 2000, 5000, 10000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    print(f"{'cards':>6} {'grid sheets':>11} {'grid used':>9} {'packed sheets':>13} {'packed used':>11} {'plan ms':>8}")
+    for num_cards in args.sizes:
+        formats, copies = make_deck(num_cards, rng)
+        grid, grid_used = grid_sheets(formats, copies, args.paper, args.separation)
+        start = time.perf_counter()
+        packed = PackedLayout(formats, copies, args.paper, args.separation)
+        elapsed = (time.perf_counter() - start)*1000
+        print(f"{sum(copies):>6} {grid:>11} {grid_used:>9.1%} {packed.sheetCount():>13} {packed.utilization():>11.1%} {elapsed:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Fixed export, import and layout scenarios over synthetic card images, saved as JSON to compare commits.
+
+    python benchmarks/suite.py [-o results.json] [--only 'export-*'] [--repeat 3] [--compare old.json]
+
+Every scenario runs in a fresh process, so its peak RSS is its own. Images are generated once in
+--workdir and reused by later runs, generating them is never timed.
+"""
+import argparse, base64, contextlib, fnmatch, io, json, os, platform, random, shutil, subprocess, sys, tempfile, threading, time, zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT/"Card2PDF"))
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Card pictures as downloaded (YGOPro), at 300 dpi and at 600 dpi for a 63x88 mm card
+RESOLUTIONS = dict(low=(421, 614), print=(744, 1039), high=(1488, 2079))
+CARD_FORMAT = [63, 88]
+PAPER_FORMAT = [432, 279]
+
+def export_scenario(cards, unique, resolution):
+    return dict(kind="export", cards=cards, unique=unique, resolution=resolution)
+
+SCENARIOS = {
+    "export-60-low": export_scenario(60, 60, "low"),
+    "export-60-print": export_scenario(60, 60, "print"),
+    "export-60-high": export_scenario(60, 60, "high"),
+    "export-600-print": export_scenario(600, 150, "print"),
+    "export-600-unique-print": export_scenario(600, 600, "print"),
+    "export-6000-print": export_scenario(6000, 300, "print"),
+    "thumbnails-600-cold": dict(kind="thumbnails", cards=600, resolution="print", warm=False),
+    "thumbnails-600-warm": dict(kind="thumbnails", cards=600, resolution="print", warm=True),
+    "parse-ygo-deck": dict(kind="deck", decks=20000),
+    "download-200-cold": dict(kind="download", cards=200, resolution="low", refresh=False),
+    "download-200-refresh": dict(kind="download", cards=200, resolution="low", refresh=True),
+}
+
+def card_images(workdir, resolution, count):
+    """Paths of `count` distinct card JPEGs, the ones missing are generated."""
+    from PyQt5.QtCore import QRectF, Qt
+    from PyQt5.QtGui import QColor, QFont, QGuiApplication, QImage, QLinearGradient, QPainter
+    if QGuiApplication.instance() is None:
+        card_images.app = QGuiApplication(["bench"])
+    directory = Path(workdir)/"images"/resolution
+    directory.mkdir(parents=True, exist_ok=True)
+    width, height = RESOLUTIONS[resolution]
+    paths = []
+    for it in range(count):
+        path = directory/f"card_{it:05d}.jpg"
+        paths.append(str(path))
+        if path.exists():
+            continue
+        # Gradients, flat boxes and text compress about like real card art, noise wouldn't
+        rng = random.Random(it)
+        img = QImage(width, height, QImage.Format_RGB32)
+        painter = QPainter(img)
+        gradient = QLinearGradient(0, 0, width, height)
+        gradient.setColorAt(0, QColor(*(rng.randrange(256) for _ in range(3))))
+        gradient.setColorAt(1, QColor(*(rng.randrange(256) for _ in range(3))))
+        painter.fillRect(img.rect(), gradient)
+        for _ in range(12):
+            painter.fillRect(QRectF(rng.random()*width, rng.random()*height, rng.random()*width/2, rng.random()*height/3),
+                             QColor(*(rng.randrange(256) for _ in range(4))))
+        painter.setFont(QFont("Sans", max(8, width//20)))
+        painter.drawText(QRectF(0, 0, width, height/8), Qt.AlignCenter, f"Card {it}")
+        painter.end()
+        img.save(str(path), "JPG", 90)
+    return paths
+
+def run_export(scenario, workdir, engine):
+    from PyQt5.QtGui import QGuiApplication
+    from CardPDFWriter import Resample
+    from settings import PDF_ENGINES
+    app = QGuiApplication.instance() or QGuiApplication(["bench"])
+    paths = card_images(workdir, scenario["resolution"], scenario["unique"])
+    copies = [scenario["cards"]//scenario["unique"]]*scenario["unique"]
+    for it in range(scenario["cards"] - sum(copies)):
+        copies[it] += 1
+    out = Path(workdir)/f"export-{engine}.pdf"
+    # A previous export next to it would be copied from instead of built
+    out.with_suffix(".layout.json").unlink(missing_ok=True)
+    start = time.perf_counter()
+    writer = PDF_ENGINES[engine](out, CARD_FORMAT, PAPER_FORMAT, [0.8, 0.8], Resample.SMOOTH)
+    writer.addCards(zip(paths, copies), os.cpu_count())
+    writer.close()
+    wall = time.perf_counter() - start
+    return dict(wall=wall, bytes=out.stat().st_size, pages=writer.pageCount)
+
+def run_thumbnails(scenario, workdir):
+    from PyQt5.QtCore import QEventLoop, Qt
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(["bench"])
+    paths = card_images(workdir, scenario["resolution"], scenario["cards"])
+    import main
+    from card_model import PREVIEW
+    from thumbnails import ThumbnailCache
+    cache_dir = Path(workdir)/"thumbs"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    gui = main.Card2PDFGUI()
+    gui.thumbnailLoader.cache = ThumbnailCache(cache_dir)
+    if scenario["warm"]:
+        for path in paths:
+            gui.thumbnailLoader.cache.load(path)
+    ready = []
+    gui.thumbnailLoader.ready.connect(lambda path, img: ready.append(path))
+    start = time.perf_counter()
+    gui.addImgsToTable(paths)
+    # What the table view asks for when the rows are shown
+    for row in range(gui.cardModel.rowCount()):
+        gui.cardModel.data(gui.cardModel.index(row, PREVIEW), Qt.DecorationRole)
+    while len(ready) < len(paths):
+        app.processEvents(QEventLoop.AllEvents, 50)
+    wall = time.perf_counter() - start
+    return dict(wall=wall, bytes=sum(f.stat().st_size for f in cache_dir.iterdir()))
+
+def deck_code(main_deck, side_deck):
+    ids = main_deck + side_deck
+    data = bytes([len(main_deck), len(side_deck)]) + b"".join(card_id.to_bytes(4, "little") for card_id in ids)
+    compressor = zlib.compressobj(wbits=-15)
+    return base64.b64encode(compressor.compress(data) + compressor.flush()).decode()
+
+def run_deck(scenario, workdir):
+    from PyQt5.QtGui import QGuiApplication
+    app = QGuiApplication.instance() or QGuiApplication(["bench"])
+    import ygo_parser
+    rng = random.Random(0)
+    pool = [rng.randrange(10**7, 10**8) for _ in range(60)]
+    codes = [deck_code([rng.choice(pool) for _ in range(40)], [rng.choice(pool) for _ in range(15)])
+             for _ in range(100)]
+    clipboard = QGuiApplication.clipboard()
+    start = time.perf_counter()
+    # parse_ygo_deck prints the clipboard, keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for it in range(scenario["decks"]):
+            clipboard.setText(codes[it % len(codes)])
+            ygo_parser.parse_ygo_deck()
+    wall = time.perf_counter() - start
+    return dict(wall=wall, bytes=0, per_deck_us=wall/scenario["decks"]*1e6)
+
+def mock_server(pictures):
+    """Serves /<card id>.jpg from memory with ETags, like the YGOPro image host. Returns (server, base url)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            card_id = self.path.rsplit("/", 1)[-1].removesuffix(".jpg")
+            data = pictures.get(card_id)
+            if data is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            etag = f'"{card_id}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def run_download(scenario, workdir, threads, rate):
+    from downloader import Downloader
+    from pic_cache import PicCache
+    import ygo_parser
+    paths = card_images(workdir, scenario["resolution"], scenario["cards"])
+    pictures = {str(10**7 + it): Path(path).read_bytes() for it, path in enumerate(paths)}
+    server, base_url = mock_server(pictures)
+    pic_dir = Path(workdir)/"pics"
+    shutil.rmtree(pic_dir, ignore_errors=True)
+    ygo_parser.PIC_CACHE = PicCache(pic_dir)
+    work = lambda card_id, downloader: ygo_parser.download_pic_by_id(card_id, downloader, base_url, scenario["refresh"])
+    with Downloader(threads, rate) as downloader:
+        if scenario["refresh"]:
+            # Already downloaded once, the server answers 304 to every card
+            for card_id in pictures:
+                ygo_parser.download_pic_by_id(card_id, downloader, base_url)
+        start = time.perf_counter()
+        results = list(downloader.map(lambda card_id: work(card_id, downloader), pictures))
+        wall = time.perf_counter() - start
+    server.shutdown()
+    if any(path is None for _, path in results):
+        raise RuntimeError("Some downloads failed")
+    return dict(wall=wall, bytes=sum(f.stat().st_size for f in pic_dir.glob("*.jpg")))
+
+def run_scenario(name, workdir, engine, threads, rate):
+    """Runs in its own process, returns the measures of one run."""
+    # ygo_parser keeps its pictures next to the script it was started from
+    sys.argv[0] = str(Path(workdir)/"bench")
+    scenario = SCENARIOS[name]
+    if scenario["kind"] == "export":
+        result = run_export(scenario, workdir, engine)
+    elif scenario["kind"] == "thumbnails":
+        result = run_thumbnails(scenario, workdir)
+    elif scenario["kind"] == "deck":
+        result = run_deck(scenario, workdir)
+    else:
+        result = run_download(scenario, workdir, threads, rate)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB everywhere else
+    return peak/1024**2 if sys.platform == "darwin" else peak/1024
+
+def prepare_images(names, workdir):
+    # In a process of its own, the parent never loads Qt
+    needed = {}
+    for name in names:
+        scenario = SCENARIOS[name]
+        if "resolution" in scenario:
+            count = scenario.get("unique", scenario["cards"])
+            needed[scenario["resolution"]] = max(needed.get(scenario["resolution"], 0), count)
+    for resolution, count in needed.items():
+        card_images(workdir, resolution, count)
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, old):
+    common = [name for name in results if name in old.get("scenarios", {})]
+    if not common:
+        print(f"\nNo scenario in common with commit {old.get('commit')}")
+        return
+    print(f"\nAgainst commit {old.get('commit')}")
+    print(f"{'scenario':<32} {'wall':>9} {'before':>9} {'change':>8} {'rss MB':>8} {'before':>8}")
+    for name in common:
+        result, before = results[name], old["scenarios"][name]
+        change = result["wall"]/before["wall"] - 1 if before["wall"] else 0
+        print(f"{name:<32} {result['wall']:>9.3f} {before['wall']:>9.3f} {change:>+8.1%} "
+              f"{result['peak_rss_mb'] or 0:>8.1f} {before.get('peak_rss_mb') or 0:>8.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="JSON file for the results, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--only", action="append", default=[], help="scenario name or glob, can be repeated")
+    parser.add_argument("--engine", action="append", default=[], help="PDF engine for the exports, defaults to all of them")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of every scenario, the fastest one is kept")
+    parser.add_argument("--workdir", default=str(Path(tempfile.gettempdir())/"card2pdf-bench"))
+    parser.add_argument("--download-threads", type=int, default=8)
+    parser.add_argument("--download-rate", type=float, default=0, help="requests per second, 0 for no limit")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    args = parser.parse_args(argv)
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(name, scenario)
+        return 0
+
+    names = [name for name in SCENARIOS if not args.only or any(fnmatch.fnmatch(name, pattern) for pattern in args.only)]
+    if not names:
+        parser.error(f"no scenario matches {args.only}, see --list")
+    engines = args.engine or ["Qt", "Native"]
+    Path(args.workdir).mkdir(parents=True, exist_ok=True)
+    spawn = get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+        pool.submit(prepare_images, names, args.workdir).result()
+
+    runs = [(name, engine) for name in names for engine in (engines if SCENARIOS[name]["kind"] == "export" else [None])]
+    results = {}
+    print(f"{'scenario':<32} {'wall s':>9} {'peak RSS MB':>11} {'bytes':>12}")
+    for name, engine in runs:
+        key = f"{name}/{engine}" if engine else name
+        measures = []
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                measures.append(pool.submit(run_scenario, name, args.workdir, engine,
+                                            args.download_threads, args.download_rate).result())
+        best = min(measures, key=lambda m: m["wall"])
+        best["walls"] = [m["wall"] for m in measures]
+        if best["peak_rss_mb"] is not None:
+            best["peak_rss_mb"] = max(m["peak_rss_mb"] for m in measures)
+        results[key] = best
+        print(f"{key:<32} {best['wall']:>9.3f} {best['peak_rss_mb'] or 0:>11.1f} {best['bytes']:>12}")
+
+    report = dict(commit=commit(), date=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                  platform=platform.platform(), cpus=os.cpu_count(), scenarios=results)
+    output = Path(args.output) if args.output else ROOT/"benchmarks"/"results"/f"{(report['commit'] or 'local')[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Saved to {output}")
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import os, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"Card2PDF"))
+
+from card_index import PREFIX_BYTES, CardIndex, normalize_path
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+def test_same_path_or_content(tmp_path):
+    index = CardIndex()
+    card = write(tmp_path/"card.jpg", b"card"*100)
+    assert index.add(card) is None
+    assert card in index
+    # Another spelling of the same file, then a copy of it
+    assert index.add(str(tmp_path/"."/"card.jpg")) == card
+    assert index.add(write(tmp_path/"copy.jpg", b"card"*100)) == card
+    assert index.add(write(tmp_path/"other.jpg", b"drac"*100)) is None
+    # Small files are read whole for their bucket, never hashed again
+    assert not index.fullHashes
+
+def test_size_and_prefix_buckets(tmp_path):
+    index = CardIndex()
+    prefix = os.urandom(PREFIX_BYTES)
+    card = write(tmp_path/"card.jpg", prefix + b"a"*1000)
+    assert index.add(card) is None
+    # Different size or different first 64 KiB: another bucket, nothing hashed whole
+    assert index.add(write(tmp_path/"longer.jpg", prefix + b"a"*1001)) is None
+    assert index.add(write(tmp_path/"start.jpg", b"b" + prefix[1:] + b"a"*1000)) is None
+    assert len(index.buckets) == 3
+    assert not index.fullHashes
+    # Same bucket, only the whole hash tells them apart
+    tail = write(tmp_path/"tail.jpg", prefix + b"a"*999 + b"b")
+    assert index.add(tail) is None
+    assert set(index.fullHashes) == {normalize_path(card), normalize_path(tail)}
+    assert index.add(write(tmp_path/"copy.jpg", prefix + b"a"*1000)) == card
+
+def test_remove(tmp_path):
+    index = CardIndex()
+    card = write(tmp_path/"card.jpg", b"card"*100)
+    index.add(card)
+    index.remove(card)
+    assert card not in index
+    assert not index.buckets
+    copy = write(tmp_path/"copy.jpg", b"card"*100)
+    assert index.add(copy) is None
+    assert index.add(card) == copy
+    index.clear()
+    assert index.add(card) is None
+
+def test_missing_file(tmp_path):
+    index = CardIndex()
+    missing = str(tmp_path/"missing.jpg")
+    assert index.add(missing) is None
+    assert index.add(missing) == missing
+    assert not index.buckets
@@ -0,0 +1,72 @@
+import os, random, re, sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"Card2PDF"))
+
+from PyQt5.QtGui import QColor, QGuiApplication, QImage
+
+from CardPDFWriter import Resample
+from settings import PDF_ENGINES
+
+CARD_FORMAT = [59, 85.5]
+PAPER_FORMAT = [432, 279]
+
+@pytest.fixture(scope="module")
+def app():
+    return QGuiApplication.instance() or QGuiApplication(["test"])
+
+def card_image(path, seed):
+    # Noise, so the image and not the page layout is what makes the PDF big
+    rng = random.Random(seed)
+    img = QImage(300, 430, QImage.Format_RGB32)
+    for y in range(0, img.height(), 10):
+        for x in range(0, img.width(), 10):
+            color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            for dy in range(10):
+                for dx in range(10):
+                    img.setPixelColor(x + dx, y + dy, color)
+    img.save(str(path), "PNG")
+    return str(path)
+
+def export(engine, out, cards, keep_images=True):
+    writer = PDF_ENGINES[engine](str(out), CARD_FORMAT, PAPER_FORMAT, resample=Resample.NONE, keep_images=keep_images)
+    writer.addCards(cards, 1)
+    writer.close()
+    return Path(out).read_bytes()
+
+def image_objects(pdf):
+    return len(re.findall(rb"/Subtype\s*/Image", pdf))
+
+engines = pytest.mark.parametrize("engine", list(PDF_ENGINES))
+keep_images = pytest.mark.parametrize("keep_images", [True, False])
+
+@engines
+@keep_images
+def test_size_flat_with_copies(app, tmp_path, engine, keep_images):
+    card = card_image(tmp_path/"card.png", 1)
+    one = export(engine, tmp_path/"one.pdf", [(card, 1)], keep_images)
+    many = export(engine, tmp_path/"many.pdf", [(card, 30)], keep_images)
+    assert image_objects(many) == 1
+    # 30 copies fill 2 sheets, only the page contents grow
+    assert len(many)/len(one) < 1.1
+
+@engines
+@keep_images
+def test_same_content_embedded_once(app, tmp_path, engine, keep_images):
+    first = card_image(tmp_path/"first.png", 2)
+    second = card_image(tmp_path/"second.png", 2)
+    other = card_image(tmp_path/"other.png", 3)
+    assert image_objects(export(engine, tmp_path/"same.pdf", [(first, 3), (second, 3)], keep_images)) == 1
+    assert image_objects(export(engine, tmp_path/"other.pdf", [(first, 3), (other, 3)], keep_images)) == 2
+
+@engines
+@keep_images
+def test_repeat_after_other_card(app, tmp_path, engine, keep_images):
+    first = card_image(tmp_path/"first.png", 4)
+    other = card_image(tmp_path/"other.png", 5)
+    copy = card_image(tmp_path/"copy.png", 4)
+    cards = [(first, 3), (other, 3), (copy, 3), (first, 3)]
+    assert image_objects(export(engine, tmp_path/"repeat.pdf", cards, keep_images)) == 2
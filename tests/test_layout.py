@@ -0,0 +1,138 @@
+import itertools, sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"Card2PDF"))
+
+from layout import CUT_LINES, PackedLayout, SheetLayout
+
+LEDGER = [432, 279]
+A4 = [210, 297]
+# card format, paper format, packing, cards per sheet
+SHEETS = [
+    ([63, 88], LEDGER, "Upright", 18),
+    ([63, 88], LEDGER, "Mixed", 20),
+    ([59, 85.5], LEDGER, "Upright", 21),
+    ([59, 85.5], LEDGER, "Mixed", 22),
+    ([59, 86], A4[::-1], "Upright", 8),
+    ([59, 86], A4[::-1], "Mixed", 10),
+    ([100, 150], A4, "Upright", 2),
+    ([100, 150], A4, "Mixed", 3),
+]
+COPIES = [3, 0, 7, 20, 1]
+
+def overlap(a, b):
+    return a.x < b.x + b.width and b.x < a.x + a.width and a.y < b.y + b.height and b.y < a.y + a.height
+
+def crosses(line, slot):
+    # Cut lines are either vertical or horizontal
+    if line.x1 == line.x2:
+        lo, hi = sorted((line.y1, line.y2))
+        return slot.x < line.x1 < slot.x + slot.width and lo < slot.y + slot.height and slot.y < hi
+    lo, hi = sorted((line.x1, line.x2))
+    return slot.y < line.y1 < slot.y + slot.height and lo < slot.x + slot.width and slot.x < hi
+
+def sheet(card, paper, packing):
+    return SheetLayout(card, paper, (0.8, 0.8), 300, packing)
+
+@pytest.mark.parametrize("card, paper, packing, per_sheet", SHEETS)
+def test_slots_per_sheet(card, paper, packing, per_sheet):
+    layout = sheet(card, paper, packing)
+    assert layout.slotsPerSheet == per_sheet
+    # The turned slots of Mixed are the card turned, not another size
+    for slot in layout.slots:
+        size = [slot.width, slot.height] if slot.rotation == 0 else [slot.height, slot.width]
+        assert size == pytest.approx(layout.cardFormat)
+
+@pytest.mark.parametrize("card, paper, packing, per_sheet", SHEETS)
+def test_sheet_count_matches_plan(card, paper, packing, per_sheet):
+    layout = sheet(card, paper, packing)
+    plan = layout.plan(COPIES)
+    assert len(plan) == sum(COPIES)
+    assert [p.card for p in plan] == [card for card, copies in enumerate(COPIES) for _ in range(copies)]
+    assert max(p.page for p in plan) + 1 == layout.sheetCount(COPIES)
+    for it, placement in enumerate(plan):
+        page, slot = layout.slotAt(it)
+        assert (placement.page, *slot) == placement[:6]
+    assert layout.sheetCount([0]) == 1
+
+@pytest.mark.parametrize("card, paper, packing, per_sheet", SHEETS)
+def test_slots_on_the_sheet_without_overlap(card, paper, packing, per_sheet):
+    layout = sheet(card, paper, packing)
+    for slot in layout.slots:
+        assert 0 <= slot.x and slot.x + slot.width <= layout.paperFormat[0]
+        assert 0 <= slot.y and slot.y + slot.height <= layout.paperFormat[1]
+    for a, b in itertools.combinations(layout.slots, 2):
+        assert not overlap(a, b)
+
+@pytest.mark.parametrize("style", CUT_LINES)
+@pytest.mark.parametrize("card, paper, packing, per_sheet", SHEETS)
+def test_cut_lines_dont_cross_cards(card, paper, packing, per_sheet, style):
+    layout = sheet(card, paper, packing)
+    lines = layout.pageCutLines(0, style)
+    if style != "None":
+        assert lines
+    for line in lines:
+        assert not any(crosses(line, slot) for slot in layout.slots), line
+
+# card formats, copies of each, paper format
+PACKED = [
+    ([[59, 85.5], [63, 88]], [12, 30], LEDGER),
+    ([[63, 88], [59, 85.5], [100, 150]], [5, 0, 3], A4),
+    ([[100, 150], [59, 86], [290, 200]], [2, 9, 1], A4),
+]
+
+def packed_pages(layout):
+    pages = {}
+    for it in range(len(layout.placements)):
+        page, slot = layout.slotAt(it)
+        pages.setdefault(page, []).append(slot)
+    return pages
+
+@pytest.mark.parametrize("formats, copies, paper", PACKED)
+def test_packed_places_every_copy(formats, copies, paper):
+    layout = PackedLayout(formats, copies, paper)
+    placed = [p.card for p in layout.placements]
+    assert sorted(placed) == [card for card, num_copies in enumerate(copies) for _ in range(num_copies)]
+    # Drawn in layout.order, copies of a card together
+    assert list(dict.fromkeys(placed)) == layout.order
+    assert sorted(packed_pages(layout)) == list(range(layout.sheetCount()))
+    for p in layout.placements:
+        size = [p.width, p.height] if p.rotation == 0 else [p.height, p.width]
+        assert size == pytest.approx([x*300/25.4 for x in formats[p.card]])
+    assert 0 < layout.utilization() <= 1
+
+@pytest.mark.parametrize("formats, copies, paper", PACKED)
+def test_packed_slots_on_the_sheet_without_overlap(formats, copies, paper):
+    layout = PackedLayout(formats, copies, paper)
+    eps = 1e-6
+    for slots in packed_pages(layout).values():
+        for slot in slots:
+            assert -eps <= slot.x and slot.x + slot.width <= layout.paperFormat[0] + eps
+            assert -eps <= slot.y and slot.y + slot.height <= layout.paperFormat[1] + eps
+        for a, b in itertools.combinations(slots, 2):
+            assert not overlap(a, b)
+
+@pytest.mark.parametrize("style", CUT_LINES)
+@pytest.mark.parametrize("formats, copies, paper", PACKED)
+def test_packed_cut_lines_dont_cross_cards(formats, copies, paper, style):
+    layout = PackedLayout(formats, copies, paper)
+    for page, slots in packed_pages(layout).items():
+        lines = layout.pageCutLines(page, style)
+        if style != "None":
+            assert lines
+        for line in lines:
+            assert not any(crosses(line, slot) for slot in slots), line
+
+def test_packed_same_sheets_as_the_grid():
+    # A single format packs as tightly as the plain grid
+    grid = sheet([63, 88], LEDGER, "Upright")
+    layout = PackedLayout([[63, 88]], [50], LEDGER)
+    assert layout.sheetCount() <= grid.sheetCount([50])
+
+def test_packed_card_bigger_than_the_paper():
+    with pytest.raises(ValueError, match="300x300 mm card doesn't fit on 210x297 mm paper"):
+        PackedLayout([[59, 85.5], [300, 300]], [3, 1], A4)
+    # Unless none of its copies are drawn
+    assert PackedLayout([[59, 85.5], [300, 300]], [3, 0], A4).sheetCount() == 1